@@ -0,0 +1,92 @@
+"""
+Encode and decode throughput of the installed codecs for typical and large messages.
+
+    python benchmarks/codec.py [--repeat N]
+
+Codecs whose package isn't installed are skipped.
+"""
+
+import os
+import sys
+import argparse
+import random
+import string
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # The vscode in this tree
+
+from vscode.codec import CODECS
+
+
+def make_text(size: int) -> str:
+    random.seed(0)
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(1, 10))) for _ in range(1000)]
+    lines = []
+    total = 0
+    while total < size:
+        line = "    " * random.randint(0, 3) + " ".join(random.choices(words, k=random.randint(0, 12)))
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)
+
+
+def payloads() -> dict:
+    quick_pick = [
+        {"label": f"item {i}", "description": f"description of item {i}", "detail": f"src/module_{i}.py"}
+        for i in range(50_000)
+    ]
+    return {
+        # Python to extension.js
+        "procedure call": {"type": 5, "fn": 12, "args": ["Hello", [], None], "uuid": "0" * 36},
+        "quick pick 50k items": {"type": 5, "fn": 20, "args": [quick_pick, None], "uuid": "0" * 36},
+        # extension.js to Python
+        "command": {"type": 1, "name": "hello-world", "data": {}},
+        "response": {"type": 3, "uuid": "0" * 36, "data": {"handle": 1, "uri": "file:///a.py"}},
+        "document edit": {
+            "type": 5,
+            "action": "change",
+            "uri": "file:///a.py",
+            "version": 2,
+            "changes": [[10, 4, 10, 4, "x"]],
+        },
+        "document open 5MB": {
+            "type": 5,
+            "action": "open",
+            "uri": "file:///a.py",
+            "version": 1,
+            "languageId": "python",
+            "text": make_text(5 * 1024 * 1024),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    codecs = []
+    for name, cls in CODECS.items():
+        try:
+            codecs.append(cls())
+        except ImportError:
+            print(f"{name} isn't installed, skipped")
+
+    for label, payload in payloads().items():
+        print(f"\n{label}")
+        for codec in codecs:
+            data = codec.encode(payload)
+            size = len(data.encode() if isinstance(data, str) else data)
+            number, _ = timeit.Timer(lambda: codec.encode(payload)).autorange()
+            encode = min(timeit.repeat(lambda: codec.encode(payload), number=number, repeat=args.repeat))
+            decode = min(timeit.repeat(lambda: codec.decode(data), number=number, repeat=args.repeat))
+            encode, decode = encode / number, decode / number
+            print(
+                f"  {codec.name:8} {size / 1024:10.1f} KB"
+                f"  encode {encode * 1e6:10.1f} us {size / encode / 2**20:8.1f} MB/s"
+                f"  decode {decode * 1e6:10.1f} us {size / decode / 2**20:8.1f} MB/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Command dispatch with many registered commands.
+
+    python benchmarks/dispatch.py [--commands N ...] [--messages N] [--repeat N]
+
+Times the lookup of a command by name, against the linear search over Extension.commands
+that it replaced, and the whole path of a command message from Extension.parse_ws_data
+until the command has run.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # The vscode in this tree
+
+import vscode
+
+
+def make_extension(count: int, done: asyncio.Future, messages: int) -> vscode.Extension:
+    ext = vscode.Extension("Dispatch Benchmark")
+    calls = 0
+
+    async def command(ctx):
+        nonlocal calls
+        calls += 1
+        if calls == messages:
+            done.set_result(None)
+
+    for i in range(count):
+        ext.register_command(command, name=f"command-{i}")
+    return ext
+
+
+async def run(count: int, messages: int, repeat: int) -> None:
+    ext = make_extension(count, asyncio.get_running_loop().create_future(), messages)
+    names = [command.name for command in ext.commands]
+    random.seed(0)
+    targets = random.choices(names, k=messages)
+
+    def linear():
+        for name in targets:
+            next(command for command in ext.commands if command.name == name)
+
+    def mapped():
+        for name in targets:
+            ext.command_map[name]
+
+    for label, func in (("linear search", linear), ("command_map", mapped)):
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"  lookup {label:14} {best / messages * 1e6:8.2f} us per command")
+
+    best = float("inf")
+    for _ in range(repeat):
+        done = asyncio.get_running_loop().create_future()
+        ext = make_extension(count, done, messages)
+        start = time.perf_counter()
+        for name in targets:
+            await ext.parse_ws_data({"type": 1, "name": name})
+        await done
+        best = min(best, time.perf_counter() - start)
+    print(f"  parse_ws_data to run  {best / messages * 1e6:8.2f} us per command")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commands", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for count in args.commands:
+        print(f"\n{count} commands")
+        asyncio.run(run(count, args.messages, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
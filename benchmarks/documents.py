@@ -0,0 +1,133 @@
+"""
+Synced documents of 10MB under a stream of random edits, the rope against a plain string.
+
+    python benchmarks/documents.py [--size MB] [--edits N] [--reads N]
+
+Times applying edits, taking snapshots, reading ranges of lines, reading single lines
+like TextDocument.line_at and getting the whole text, each after the edits.
+"""
+
+import os
+import sys
+import time
+import random
+import string
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # The vscode in this tree
+
+from vscode.documents import DocumentMirror, TextSnapshot
+
+
+class StrMirror(TextSnapshot):
+    """
+    A DocumentMirror that keeps its text in a str, every edit copies the whole text.
+    """
+
+    def snapshot(self) -> TextSnapshot:
+        snapshot = TextSnapshot(self.uri, self.version, self.language_id, self._text)
+        snapshot._lines = self._lines
+        return snapshot
+
+    def apply_changes(self, version: int, changes: list) -> None:
+        for sl, sc, el, ec, text in changes:
+            start = self.offset(sl, sc)
+            end = self.offset(el, ec)
+            self._text = self._text[:start] + text + self._text[end:]
+            self._lines = None
+        self.version = version
+
+
+def make_text(size: int) -> str:
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(1, 10))) for _ in range(1000)]
+    lines = []
+    total = 0
+    while total < size:
+        line = "    " * random.randint(0, 3) + " ".join(random.choices(words, k=random.randint(0, 12)))
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)
+
+
+def make_edits(count: int, line_count: int) -> list:
+    """
+    Mostly typing and deleting characters, with some pasted and deleted blocks of lines.
+    """
+    edits = []
+    for _ in range(count):
+        line = random.randrange(line_count - 20)
+        character = random.randint(0, 20)
+        kind = random.random()
+        if kind < 0.6:
+            edits.append([line, character, line, character, random.choice(string.ascii_lowercase)])
+        elif kind < 0.9:
+            edits.append([line, character, line, character + 1, ""])
+        elif kind < 0.95:
+            edits.append([line, 0, line, 0, "pasted line\n" * random.randint(1, 10)])
+        else:
+            edits.append([line, 0, line + random.randint(1, 10), 0, ""])
+    return edits
+
+
+def timed(label: str, count: int, func) -> None:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:28} {elapsed / count * 1e6:12.1f} us each  {elapsed:8.3f} s total")
+
+
+def run(cls, text: str, edits: list, reads: int) -> None:
+    document = cls("file:///a.py", 1, "python", text)
+    document.line_count  # The line index of the first version is built when the document is opened
+
+    def apply():
+        for version, edit in enumerate(edits, 2):
+            document.apply_changes(version, [edit])
+            document.offset(edit[0], 0)  # The next edit looks a position up in this version
+
+    def snapshots():
+        for _ in range(reads):
+            document.snapshot()
+
+    line_count = document.line_count
+    starts = [random.randrange(line_count - 50) for _ in range(reads)]
+
+    def line_reads():
+        snapshot = document.snapshot()
+        for start in starts:
+            snapshot.line_texts(start, start + 50)
+
+    def line_at():
+        for start in starts:
+            document.line_text(start)
+
+    def get_text():
+        document.snapshot().get_text()
+
+    timed("edit", len(edits), apply)
+    timed("snapshot", reads, snapshots)
+    timed("read 50 lines", reads, line_reads)
+    timed("line_at", reads, line_at)
+    timed("whole text after the edits", 1, get_text)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=float, default=10, help="The size of the document in MB")
+    parser.add_argument("--edits", type=int, default=500)
+    parser.add_argument("--reads", type=int, default=1000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    text = make_text(int(args.size * 1024 * 1024))
+    edits = make_edits(args.edits, text.count("\n") + 1)
+    print(f"{len(text) / 2**20:.1f} MB, {text.count(chr(10)) + 1} lines, {len(edits)} edits")
+
+    for cls in (DocumentMirror, StrMirror):
+        print(f"\n{cls.__name__}")
+        random.seed(1)
+        run(cls, text, edits, args.reads)
+
+
+if __name__ == "__main__":
+    main()
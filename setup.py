@@ -38,5 +38,9 @@ setup(
         "Topic :: Utilities",
     ],
     install_requires=["websockets"],
+    extras_require={
+        "speed": ["orjson"],
+        "binary": ["msgpack"],
+    },
     python_requires=">=3.8",
 )
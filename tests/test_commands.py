@@ -0,0 +1,157 @@
+import asyncio
+
+import vscode
+
+
+class Recorder:
+    """
+    A command that records its invocations, they run until release is set.
+    """
+
+    def __init__(self, **options) -> None:
+        self.started = []
+        self.finished = []
+        self.cancelled = []
+        self.times = []
+        self.release = asyncio.Event()
+
+        async def record(ctx):
+            self.started.append(ctx)
+            self.times.append(asyncio.get_running_loop().time())
+            try:
+                await self.release.wait()
+            except asyncio.CancelledError:
+                self.cancelled.append(ctx)
+                raise
+            self.finished.append(ctx)
+
+        ext = vscode.Extension("test")
+        ext.register_command(record, **options)
+        self.command = ext.command_map["record"]
+
+    def dispatch(self, *contexts) -> None:
+        for ctx in contexts:
+            self.command.dispatch(ctx)
+
+
+async def settle(seconds: float = 0) -> None:
+    await asyncio.sleep(seconds)
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_max_concurrency_queues():
+    async def main():
+        recorder = Recorder(max_concurrency=2)
+        recorder.dispatch(1, 2, 3)
+        await settle()
+        assert recorder.started == [1, 2]
+        recorder.release.set()
+        await settle()
+        assert recorder.started == [1, 2, 3]
+        assert recorder.finished == [1, 2, 3]
+
+    asyncio.run(main())
+
+
+def test_coalesce_drop():
+    async def main():
+        recorder = Recorder(coalesce="drop")
+        recorder.dispatch(1, 2, 3)
+        await settle()
+        recorder.release.set()
+        await settle()
+        assert recorder.started == [1]
+        recorder.dispatch(4)
+        await settle()
+        assert recorder.started == [1, 4]
+
+    asyncio.run(main())
+
+
+def test_coalesce_latest_cancels_the_oldest():
+    async def main():
+        recorder = Recorder(coalesce="latest")
+        recorder.dispatch(1)
+        await settle()
+        recorder.dispatch(2)
+        await settle()
+        assert recorder.started == [1, 2]
+        assert recorder.cancelled == [1]
+        recorder.release.set()
+        await settle()
+        assert recorder.finished == [2]
+
+    asyncio.run(main())
+
+
+def test_debounce_runs_the_last_invocation():
+    async def main():
+        recorder = Recorder(debounce_ms=100)
+        recorder.release.set()
+        recorder.dispatch(1, 2)
+        await settle(0.02)
+        recorder.dispatch(3)
+        await settle(0.02)
+        assert recorder.started == []
+        await settle(0.2)
+        assert recorder.started == [3]
+
+    asyncio.run(main())
+
+
+def test_throttle_spaces_the_starts():
+    async def main():
+        recorder = Recorder(throttle_ms=50)
+        recorder.release.set()
+        recorder.dispatch(1, 2, 3)
+        await settle(0.3)
+        assert recorder.started == [1, 2, 3]
+        # The starts are scheduled from the first one, timers can fire late but not early
+        first, second, third = recorder.times
+        assert second - first >= 0.045 and third - first >= 0.095
+
+    asyncio.run(main())
+
+
+def test_throttle_drop():
+    async def main():
+        recorder = Recorder(throttle_ms=50, coalesce="drop")
+        recorder.release.set()
+        recorder.dispatch(1, 2)
+        await settle(0.15)
+        assert recorder.started == [1]
+        recorder.dispatch(3)
+        await settle()
+        assert recorder.started == [1, 3]
+
+    asyncio.run(main())
+
+
+def test_throttle_latest():
+    async def main():
+        recorder = Recorder(throttle_ms=100, coalesce="latest")
+        recorder.release.set()
+        recorder.dispatch(1, 2, 3)
+        await settle()
+        assert recorder.started == [1]
+        await settle(0.25)
+        assert recorder.started == [1, 3]
+        assert recorder.times[1] - recorder.times[0] >= 0.095
+
+    asyncio.run(main())
+
+
+def test_debounce_with_max_concurrency():
+    async def main():
+        recorder = Recorder(debounce_ms=20, coalesce="drop")
+        recorder.dispatch(1)
+        await settle(0.1)
+        recorder.dispatch(2)
+        await settle(0.1)
+        assert recorder.started == [1]  # 2 was debounced, then dropped while 1 was running
+        recorder.release.set()
+        await settle()
+        assert recorder.finished == [1]
+
+    asyncio.run(main())
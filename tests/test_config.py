@@ -0,0 +1,36 @@
+from vscode.config import Config, ConfigCache
+
+
+def test_convert_bool():
+    config = Config("flag", "A flag", bool, default=True)
+    assert config.convert("false") is False
+    assert config.convert(" True ") is True
+    assert config.convert("0") is False
+    assert config.convert(1) is True
+    assert config.convert(False) is False
+    assert config.convert("maybe") is True
+    assert config.convert(None) is True
+
+
+def test_convert_int():
+    config = Config("size", "A size", int, default=10)
+    assert config.convert(3) == 3
+    assert config.convert(3.0) == 3
+    assert config.convert("42") == 42
+    assert config.convert("4.0") == 4
+    assert config.convert(3.5) == 10
+    assert config.convert("3.5") == 10
+    assert config.convert(True) == 10
+    assert config.convert("many") == 10
+
+
+def test_cache_fills_defaults():
+    cache = ConfigCache([Config("size", "A size", int, default=10), Config("name", "A name", str, default="a")])
+    assert "size" not in cache
+    cache.update({"name": "b"})
+    assert cache["size"] == 10
+    assert cache["name"] == "b"
+    cache.update({"size": None})
+    assert cache["size"] == 10
+    cache.update({"size": "12"})
+    assert cache["size"] == 12
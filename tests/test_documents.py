@@ -0,0 +1,61 @@
+import sys
+
+from vscode.documents import TextCache, TextSnapshot
+from vscode.rope import Rope
+
+
+def snapshot(uri: str, version: int, text: str) -> TextSnapshot:
+    return TextSnapshot(uri, version, "plaintext", text)
+
+
+def test_text_cache_put_same_version_twice():
+    cache = TextCache(1024 * 1024)
+    first = snapshot("file:///a", 1, "a" * 1000)
+    cache.put(first)
+    cache.put(snapshot("file:///a", 1, "a" * 1000))
+    cache.put(snapshot("file:///b", 1, "b" * 1000))
+    assert len(cache) == 2
+    assert cache.size == sys.getsizeof(first.text) * 2
+
+
+def test_text_cache_size_after_eviction():
+    text = "x" * 1000
+    cache = TextCache(sys.getsizeof(text) * 2)
+    for version in range(5):
+        cache.put(snapshot("file:///a", 1, text))
+        cache.put(snapshot("file:///b", version, text))
+    assert len(cache) == 2
+    assert cache.size == sum(sys.getsizeof(s.text) for s in cache.entries.values())
+    assert cache.get("file:///a") is not None
+
+
+def test_text_cache_new_version_drops_old_one():
+    cache = TextCache(1024 * 1024)
+    cache.put(snapshot("file:///a", 1, "old"))
+    cache.set_version("file:///a", 2)
+    assert cache.get("file:///a") is None
+    assert cache.size == 0
+
+
+def test_text_cache_put_older_version():
+    cache = TextCache(1024 * 1024)
+    cache.set_version("file:///a", 2)
+    cache.put(snapshot("file:///a", 1, "old"))
+    assert cache.version("file:///a") == 2
+    assert cache.get("file:///a") is None
+    assert cache.size == 0
+
+
+def test_utf16_offsets_of_a_str_snapshot():
+    text = "ab\nc😀d\r\né😀\n"
+    cached = snapshot("file:///a", 1, text)
+    rope = TextSnapshot("file:///a", 1, "plaintext", Rope(text))
+    for index in range(len(text) + 1):
+        assert cached.to_utf16(index) == rope.to_utf16(index)
+    for offset in range(len(text.encode("utf-16-le")) // 2 + 1):
+        assert cached.from_utf16(offset) == rope.from_utf16(offset)
+    assert cached._rope is None  # The text wasn't copied into a Rope
+
+    ascii = snapshot("file:///b", 1, "plain\ntext")
+    assert ascii.to_utf16(7) == 7 and ascii.from_utf16(7) == 7
+    assert ascii._rope is None
@@ -0,0 +1,55 @@
+from vscode.files import FileIndex
+
+
+def make_index(tmp_path, files):
+    for path in files:
+        path = tmp_path / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+    index = FileIndex([str(tmp_path)])
+    index.scan()
+    index.flush()
+    return index
+
+
+def test_fuzzy(tmp_path):
+    index = make_index(tmp_path, ["src/main.py", "src/model.py", "lib/main.py", "README.md"])
+    assert index.fuzzy("main") == [str(tmp_path / "lib/main.py"), str(tmp_path / "src/main.py")]
+    assert index.fuzzy("src/mpy") == [str(tmp_path / "src/main.py"), str(tmp_path / "src/model.py")]
+    assert index.fuzzy("mdl") == [str(tmp_path / "src/model.py")]
+    assert index.fuzzy("xyz") == []
+
+
+def test_fuzzy_without_match_is_linear(tmp_path):
+    index = make_index(tmp_path, [])
+    index._add_dir(str(tmp_path))
+    for i in range(2000):
+        index._add_file(str(tmp_path), "a" * 40 + str(i))
+    assert index.fuzzy("a" * 20 + "z") == []
+
+
+def test_resolve_and_apply(tmp_path):
+    index = make_index(tmp_path, ["a/old.py"])
+    (tmp_path / "a/old.py").unlink()
+    (tmp_path / "new/deep").mkdir(parents=True)
+    (tmp_path / "new/deep/file.py").touch()
+    (tmp_path / "node_modules").mkdir()
+    (tmp_path / "node_modules/skip.js").touch()
+    events = [
+        ["delete", str(tmp_path / "a/old.py")],
+        ["create", str(tmp_path / "new")],
+        ["create", str(tmp_path / "node_modules/skip.js")],
+    ]
+    changes = index.resolve(events)
+    assert str(tmp_path / "a/old.py") in index  # resolve doesn't modify the index
+    index.apply(changes)
+    assert sorted(index) == [str(tmp_path / "new/deep/file.py")]
+
+
+def test_changes_wait_for_the_scan(tmp_path):
+    index = FileIndex([str(tmp_path)])
+    (tmp_path / "file.py").touch()
+    index.apply(index.resolve([["create", str(tmp_path / "file.py")]]))
+    assert len(index) == 0
+    index.flush()
+    assert list(index) == [str(tmp_path / "file.py")]
@@ -0,0 +1,71 @@
+import asyncio
+from types import SimpleNamespace
+
+import vscode
+from vscode.documents import DocumentStore, TextCache
+from vscode.objects import Position, Range
+from vscode.window import TextDocument
+
+
+URI = "file:///test.py"
+
+
+def synced_document(text: str) -> TextDocument:
+    ws = SimpleNamespace(documents=DocumentStore(), text_cache=TextCache(1024 * 1024))
+    ws.documents.handle(
+        {"action": "open", "uri": URI, "version": 1, "languageId": "python", "text": text}
+    )
+    return TextDocument({"handle": 1, "uri": URI}, ws)
+
+
+def test_get_lines_synced():
+    document = synced_document("first line\nsecond line\r\nthird line")
+    lines = asyncio.run(document.get_lines(Range(Position(0, 6), Position(2, 5))))
+    assert lines == ["line", "second line", "third"]
+
+
+def test_get_lines_past_the_end():
+    document = synced_document("a\nb")
+    lines = asyncio.run(document.get_lines(Range(Position(1, 0), Position(5, 3))))
+    assert lines == ["b"]
+
+
+def test_get_lines_after_edit():
+    document = synced_document("a\nb")
+    document.mirror.apply_changes(2, [[1, 1, 1, 1, "c\nd"]])
+    lines = asyncio.run(document.get_lines(Range(Position(0, 0), Position(2, 1))))
+    assert lines == ["a", "bc", "d"]
+
+
+def test_line_at_reads_only_the_line():
+    document = synced_document("  first\nsecond\n")
+    document.mirror.apply_changes(2, [[1, 0, 1, 0, "the "]])
+    line = asyncio.run(document.line_at(1))
+    assert line.text == "the second"
+    assert line.first_non_whitespace_character_index == 0
+    assert asyncio.run(document.line_at(0)).first_non_whitespace_character_index == 2
+    assert document.mirror._text is None  # The rope wasn't joined into a string
+
+
+def test_version_reported_while_fetching():
+    # extension.js answers getDocumentSnapshot and reports an edit before the read resumes
+    async def main():
+        ext = vscode.Extension("test")
+        sent = []
+
+        async def send(payload):
+            sent.append(payload)
+
+        ext.ws.send = send
+        document = TextDocument({"handle": 1, "uri": URI}, ext.ws)
+        read = asyncio.ensure_future(document.get_text())
+        while not sent:
+            await asyncio.sleep(0)
+        await ext.parse_ws_data({"type": 3, "uuid": sent[0]["uuid"], "res": [1, "python", "old"]})
+        await ext.parse_ws_data({"type": 6, "uri": URI, "version": 2})
+        assert await read == "old"
+        return ext.ws.text_cache
+
+    cache = asyncio.run(main())
+    assert cache.version(URI) == 2
+    assert cache.get(URI) is None
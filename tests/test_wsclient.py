@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+import vscode
+from vscode.wsclient import WSClient
+
+
+def client(respond) -> WSClient:
+    ws = WSClient(vscode.Extension("test"))
+
+    async def send(payload):
+        ws.resolve_response(payload["uuid"], respond(payload))
+
+    ws.send = send
+    return ws
+
+
+def run_codes(payload):
+    results, failed = [], []
+    for i, code in enumerate(payload["codes"]):
+        if code == "throw":
+            failed.append(i)
+            results.append({"error": "Error: thrown"})
+        else:
+            results.append(code.upper())
+    return {"results": results, "failed": failed}
+
+
+def test_batch_errors_are_raised_per_code():
+    async def main():
+        async with client(run_codes).batch() as batch:
+            first = batch.run_code("a")
+            second = batch.run_code("throw")
+            third = batch.run_code("{error: 1}")
+        return first, second, third
+
+    first, second, third = asyncio.run(main())
+    assert first.result() == "A"
+    with pytest.raises(RuntimeError, match="Error: thrown"):
+        second.result()
+    assert third.result() == "{ERROR: 1}"
+
+
+def test_run_many_raises_the_first_error():
+    ws = client(run_codes)
+    assert asyncio.run(ws.run_many(["a", "b"])) == ["A", "B"]
+    with pytest.raises(RuntimeError, match="Error: thrown"):
+        asyncio.run(ws.run_many(["a", "throw"]))
+    assert asyncio.run(ws.run_many([])) == []
+
+
+def test_response_error_is_raised():
+    ws = client(lambda payload: None)
+
+    async def send(payload):
+        ws.resolve_response(payload["uuid"], None, "Error: rejected")
+
+    ws.send = send
+    with pytest.raises(RuntimeError, match="Error: rejected"):
+        asyncio.run(ws.run_code("Promise.reject(new Error('rejected'))"))
+    assert ws.pending == {}
+
+
+def test_timeout_drops_the_pending_request():
+    async def main():
+        ws = client(lambda payload: None)
+        sent = []
+
+        async def send(payload):
+            sent.append(payload)
+
+        ws.send = send
+        with pytest.raises(asyncio.TimeoutError):
+            await ws.run_code("new Promise(() => {})", timeout=0.01)
+        assert ws.pending == {}
+        # A response that arrives after the timeout is ignored
+        ws.resolve_response(sent[0]["uuid"], "late")
+        assert ws.pending == {}
+
+    asyncio.run(main())
+
+
+def test_cancelled_request_is_dropped():
+    async def main():
+        ws = client(lambda payload: None)
+        ws.send = lambda payload: asyncio.sleep(0)
+        task = asyncio.ensure_future(ws.run_code("new Promise(() => {})"))
+        await asyncio.sleep(0.01)
+        assert len(ws.pending) == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert ws.pending == {}
+
+    asyncio.run(main())
+
+
+def test_cancel_pending():
+    async def main():
+        ws = client(lambda payload: None)
+        future = ws.create_future("uuid")
+        ws.cancel_pending()
+        assert future.cancelled()
+        assert ws.pending == {}
+
+    asyncio.run(main())
+
+
+def test_extension_codec():
+    assert vscode.Extension("test", codec="json").ws.codec.name == "json"
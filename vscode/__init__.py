@@ -4,12 +4,77 @@ __license__ = "MIT"
 __copyright__ = "Copyright 2021-2023 Swas.py"
 __version__ = "2.0.0b2"
 
-from .extension import *
-from .compiler import *
-from .config import *
-from .window import *
-from .objects import *
-from .context import *
-from .webviews import *
-from .enums import *
-from .utils import log
+import importlib
+
+# Submodules are imported the first time one of their names is used,
+# this keeps `--build` from importing asyncio and websockets.
+_EXPORTS = {
+    "extension": ("ExtensionMetadata", "Extension", "Command", "Event"),
+    "compiler": ("build",),
+    "config": ("EnumConfig", "Config"),
+    "window": (
+        "Window",
+        "TextEditor",
+        "TextEditorEdit",
+        "TextDocument",
+        "TextLine",
+        "Terminal",
+        "RemoteObject",
+        "QuickPick",
+        "InputBox",
+        "WindowState",
+        "Message",
+        "InfoMessage",
+        "WarningMessage",
+        "ErrorMessage",
+    ),
+    "objects": ("Object", "QuickPickItem", "QuickPickOptions", "Position", "Range"),
+    "context": ("Context",),
+    "documents": ("TextSnapshot",),
+    "rope": ("Rope",),
+    "webviews": ("WebviewPanel",),
+    "enums": ("ViewColumn", "ConfigType", "ProgressLocation"),
+    "utils": ("log",),
+}
+
+_SUBMODULES = {
+    "codec",
+    "compiler",
+    "documents",
+    "config",
+    "context",
+    "enums",
+    "env",
+    "extension",
+    "objects",
+    "events",
+    "files",
+    "procedures",
+    "rope",
+    "transports",
+    "utils",
+    "webviews",
+    "window",
+    "workspace",
+    "wsclient",
+}
+
+_NAMES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = tuple(_NAMES)
+
+
+def __getattr__(name):
+    if name in _NAMES:
+        value = getattr(importlib.import_module(f".{_NAMES[name]}", __name__), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_NAMES) | _SUBMODULES)
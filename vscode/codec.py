@@ -0,0 +1,118 @@
+import json
+from typing import Any, Optional, Union
+
+__all__ = (
+    "Codec",
+    "JSONCodec",
+    "OrjsonCodec",
+    "MsgspecCodec",
+    "MsgpackCodec",
+    "get_codec",
+)
+
+
+class Codec:
+    """
+    Encodes and decodes the messages sent between python and extension.js.
+    """
+
+    name: str = None
+    binary: bool = False
+
+    def encode(self, obj: Any) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<vscode.{self.__class__.__name__}>"
+
+
+class JSONCodec(Codec):
+    name = "json"
+
+    def encode(self, obj: Any) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._dumps = orjson.dumps
+        self._loads = orjson.loads
+
+    def encode(self, obj: Any) -> bytes:
+        return self._dumps(obj)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return self._loads(data)
+
+
+class MsgspecCodec(Codec):
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        import msgspec
+
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def encode(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return self._decoder.decode(data)
+
+
+class MsgpackCodec(Codec):
+    """
+    A binary codec, it is only used when extension.js agrees to it while connecting.
+    bytes are sent as they are instead of being encoded.
+    """
+
+    name = "msgpack"
+    binary = True
+
+    def __init__(self) -> None:
+        import msgpack
+
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def encode(self, obj: Any) -> bytes:
+        return self._packb(obj, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        return self._unpackb(data, raw=False)
+
+
+CODECS = {
+    codec.name: codec
+    for codec in (OrjsonCodec, MsgspecCodec, JSONCodec, MsgpackCodec)
+}
+JSON_CODECS = ("orjson", "msgspec", "json")
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """
+    Returns the codec with the given name.
+    If name is None, orjson or msgspec are used when they are installed and the json module otherwise.
+    Raises ImportError if the requested codec isn't installed.
+    """
+    if name is not None:
+        if name not in CODECS:
+            raise ValueError(f"Unknown codec '{name}', expected one of {list(CODECS)}")
+        return CODECS[name]()
+
+    for name in JSON_CODECS:
+        try:
+            return CODECS[name]()
+        except ImportError:
+            pass
@@ -2,9 +2,14 @@ import os
 import time
 import json
 import venv
+import shutil
 import inspect
+import subprocess
 from typing import TYPE_CHECKING
 
+from vscode.events import create_events_js
+from vscode.procedures import create_procedures_js
+
 if TYPE_CHECKING:
     from vscode.extension import Extension
 
@@ -26,6 +31,9 @@ def create_package_json(extension) -> None:
             "ws": "^8.4.0",
         },
     }
+    if extension.binary:
+        package["dependencies"]["@msgpack/msgpack"] = "^2.8.0"
+
     metadata = extension.metadata.to_dict()
     package.update(metadata)
 
@@ -104,6 +112,10 @@ def create_extension_js(extension):
         with open(get_vsc_filepath("extcode.py"), "r") as f:
             code = f.read().replace("'''", "")
 
+    code = code.replace("// func: procedures", create_procedures_js())
+    code = code.replace("// func: events", create_events_js(extension))
+    code = code.replace("<transport>", extension.transport)
+    code = code.replace("<sync_documents>", str(extension.sync_documents).lower())
     imports, contents = code.split("// func: registerCommands")
 
     file = os.path.split(inspect.stack()[-1].filename)[-1]
@@ -119,7 +131,120 @@ def create_extension_js(extension):
         f2.write(f"{imports}\n{commands_code}\n{contents}")
 
 
-def build(extension, publish=False) -> None:
+SITE_PACKAGES_DIR = "site-packages"
+
+
+def vendor_dependencies(python_path) -> None:
+    """
+    Installs the dependencies into a site-packages directory that is shipped with the extension,
+    extension.js adds it to the PYTHONPATH instead of creating a venv and running pip.
+    The build is aborted if pip fails, extension.js would run with the partial directory otherwise.
+    """
+    shutil.rmtree(SITE_PACKAGES_DIR, ignore_errors=True)
+    proc = subprocess.run(
+        [python_path, "-m", "pip", "install", "-r", "requirements.txt", "--target", SITE_PACKAGES_DIR]
+    )
+    if proc.returncode != 0:
+        shutil.rmtree(SITE_PACKAGES_DIR, ignore_errors=True)
+        raise SystemExit(f"Couldn't vendor the dependencies, pip exited with code {proc.returncode}")
+
+    compiled = [
+        os.path.join(root, file)
+        for root, _, files in os.walk(SITE_PACKAGES_DIR)
+        for file in files
+        if file.endswith((".so", ".pyd", ".dylib"))
+    ]
+    if compiled:
+        print(
+            f"\033[1;33;49mWarning: {len(compiled)} compiled extension modules were vendored, "
+            "the published extension may only work on this platform and python version.",
+            "\033[0m",
+        )
+
+
+def update_vscodeignore(*patterns) -> None:
+    lines = []
+    if os.path.isfile(".vscodeignore"):
+        with open(".vscodeignore", "r") as f:
+            lines = f.read().splitlines()
+
+    missing = [p for p in patterns if p not in lines]
+    if missing:
+        with open(".vscodeignore", "w") as f:
+            f.write("\n".join(lines + missing))
+
+
+def precompile(python_path, paths, optimize=(0,)) -> None:
+    """
+    Byte-compiles the extension and its dependencies so that python doesn't compile them on startup.
+
+    Args:
+        python_path:
+            The interpreter the extension runs with, bytecode is specific to its version.
+        paths:
+            The directories to compile, the current directory is always compiled non recursively.
+        optimize:
+            The optimization levels to compile for.
+
+    extension.js runs extension.py as a module so that its bytecode is used too.
+    compileall writes the bytecode of the optimization level python runs with, -o is only in 3.9+.
+    """
+    for level in optimize:
+        flag = {0: "", 1: "-O", 2: "-OO"}[level]
+        os.system(f"{python_path} {flag} -m compileall -q -l .")
+        for path in paths:
+            if os.path.isdir(path):
+                os.system(f"{python_path} {flag} -m compileall -q -j 0 {path}")
+
+
+def import_time_report(python_path, file, top=10) -> None:
+    """
+    Prints the modules that take the longest to import when the extension starts.
+    """
+    proc = subprocess.run(
+        [python_path, "-X", "importtime", file, "--import-time"],
+        capture_output=True,
+        text=True,
+    )
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_time, cumulative, name = line[len("import time:") :].split("|")
+            modules.append((int(cumulative), int(self_time), name.strip()))
+        except ValueError:  # The header
+            continue
+
+    if not modules:
+        print(f"\033[1;33;49mCouldn't measure the import time of {file}", "\033[0m")
+        return
+
+    total = sum(m[1] for m in modules) / 1000
+    print(
+        f"\033[1;37;49mImporting the extension takes {total:.1f}ms across {len(modules)} modules, the slowest are:",
+        "\033[0m",
+    )
+    for cumulative, self_time, name in sorted(modules, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f}ms {self_time / 1000:8.1f}ms (self)  {name}")
+
+
+def build(extension, publish=False, vendor=None, optimize=(0,)) -> None:
+    """
+    Builds the extension.
+
+    Args:
+        extension:
+            The extension to build.
+        publish:
+            Whether to create the files needed for publishing.
+        vendor:
+            Whether to ship the dependencies in a site-packages directory, defaults to publish.
+        optimize:
+            The optimization levels the extension and its dependencies are byte-compiled for.
+    """
+    vendor = publish if vendor is None else vendor
     print(f"\033[1;37;49m🚀 Building Extension '{extension.name}' ...", "\033[0m")
     start = time.time()
 
@@ -151,6 +276,20 @@ def build(extension, publish=False) -> None:
     if not os.path.isdir("./node_modules/ws"):
         os.system("npm i ws")
 
+    if extension.binary and not os.path.isdir("./node_modules/@msgpack/msgpack"):
+        os.system("npm i @msgpack/msgpack")
+
+    if vendor:
+        print(f"\033[1;37;49mVendoring dependencies...", "\033[0m")
+        vendor_dependencies(python_path)
+    elif os.path.isdir(SITE_PACKAGES_DIR):
+        # extension.js would prefer the vendored dependencies to the venv
+        shutil.rmtree(SITE_PACKAGES_DIR)
+
+    print(f"\033[1;37;49mByte-compiling...", "\033[0m")
+    precompile(python_path, [SITE_PACKAGES_DIR if vendor else "venv"], optimize)
+    import_time_report(python_path, inspect.stack()[-1].filename)
+
     if publish:
         if not os.path.isfile("README.md"):
             with open("README.md", "w") as f:
@@ -160,9 +299,9 @@ def build(extension, publish=False) -> None:
             with open("CHANGELOG.md", "w") as f:
                 pass
 
-        if not os.path.isfile(".vscodeignore"):
-            with open(".vscodeignore", "w") as f:
-                f.write(".vscode/**")
+        update_vscodeignore(".vscode/**")
+        if vendor:
+            update_vscodeignore("venv/**")
 
     end = time.time()
     time_taken = round((end - start), 2)
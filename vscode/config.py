@@ -1,8 +1,8 @@
-from typing import List, Union, Type
+from typing import Any, Dict, Iterable, List, Optional, Union, Type
 from vscode.enums import ConfigType
 
 
-__all__ = ("EnumConfig", "Config")
+__all__ = ("EnumConfig", "Config", "ConfigCache")
 
 
 class BaseConfig:
@@ -26,6 +26,38 @@ class EnumConfig(BaseConfig):
         return f"<vscode.EnumConfig name={self.name} description={self.description}>"
 
 
+BOOLEANS = {"true": True, "1": True, "yes": True, "on": True, "false": False, "0": False, "no": False, "off": False}
+
+
+def to_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in BOOLEANS:
+            return BOOLEANS[value]
+    elif isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    raise ValueError(f"{value!r} isn't a boolean")
+
+
+def to_int(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError(f"{value!r} isn't an integer")
+    if isinstance(value, str):
+        value = float(value) if any(c in value for c in ".eE") else int(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"{value!r} isn't an integer")
+        return int(value)
+    if isinstance(value, int):
+        return value
+    raise TypeError(f"{value!r} isn't an integer")
+
+
+CONVERTERS = {bool: to_bool, int: to_int, str: str}
+
+
 class Config(BaseConfig):
     def __init__(
         self,
@@ -43,6 +75,7 @@ class Config(BaseConfig):
             str: ConfigType.string,
             int: ConfigType.integer,
         }
+        self.python_type = input_type
         input_type = types[input_type]
 
         super().__init__(name=name, description=description)
@@ -63,5 +96,60 @@ class Config(BaseConfig):
 
         return out
 
+    def convert(self, value: Any) -> Any:
+        """
+        Converts a value set by the user to the type of this config,
+        the default is returned if it is unset or can't be converted.
+        Strings like "false" or "0" are parsed, numbers with a fractional part aren't integers.
+        """
+        if value is None:
+            return self.default
+        try:
+            value = CONVERTERS[self.python_type](value)
+        except (TypeError, ValueError):
+            return self.default
+        if self.enums and value not in [enum.name for enum in self.enums]:
+            return self.default
+        return value
+
     def __repr__(self):
         return f"<vscode.Config name={self.name} description={self.description} type={self.type} default={self.default} enums={[repr(enum) for enum in self.enums]}>"
+
+
+class ConfigCache:
+    """
+    The values of the configs of the extension.
+
+    extension.js sends every value when python connects and then only the ones that changed,
+    so reading a config doesn't need a round trip.
+    Values of declared configs are converted to their type with Config.convert,
+    the ones that aren't set have the default of their config.
+    """
+
+    def __init__(self, configs: Iterable[Config] = ()) -> None:
+        self.configs: Dict[str, Config] = {config.name: config for config in configs}
+        self.values: Dict[str, Any] = {}
+        self.filled = False
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.values
+
+    def __getitem__(self, name: str) -> Any:
+        return self.values[name]
+
+    def get(self, name: str, default: Optional[Any] = None) -> Any:
+        return self.values.get(name, default)
+
+    def update(self, values: Dict[str, Any]) -> None:
+        for name, value in values.items():
+            config = self.configs.get(name)
+            self.values[name] = config.convert(value) if config is not None else value
+        if not self.filled:
+            # Unset values can be missing from the first message, their configs have their default
+            for name, config in self.configs.items():
+                self.values.setdefault(name, config.default)
+            self.filled = True
+
+    def clear(self) -> None:
+        self.values.clear()
+        self.filled = False
@@ -20,6 +20,34 @@ class Context:
         self.env = Env(self.ws)
         self.workspace = Workspace(self.ws)
 
+    def batch(self, sequential: bool = True):
+        """
+        Returns a context manager that sends all the code queued in it in a single frame.
+        """
+        return self.ws.batch(sequential)
+
     @property
     def show(self):
         return self.window.show
+
+    def sync(self, awaitable):
+        """
+        Runs a coroutine on the event loop and waits for its result.
+
+        This is meant for commands that run with executor="thread" e.g.
+        `ctx.sync(ctx.show(vscode.InfoMessage("Done")))`, coroutines should be awaited instead.
+        """
+        import asyncio
+
+        loop = self.ws.loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("Context.sync can't be used on the event loop, await the coroutine instead")
+
+        async def wrapper():
+            return await awaitable
+
+        return asyncio.run_coroutine_threadsafe(wrapper(), loop).result()
@@ -0,0 +1,379 @@
+"""
+Copies of the open text documents, kept in sync by extension.js.
+
+This is used when the extension is created with sync_documents=True: extension.js sends
+the full text of a document when it is opened and then only the edits made to it,
+so reading a document doesn't need a round trip.
+
+The texts of the documents that aren't synced, every document without document sync and
+output channels with it, are kept in a TextCache when they are fetched and extension.js
+reports the new version of those documents when they change.
+
+Positions are in UTF-16 code units like in vscode, they are converted to indexes of python strings here.
+"""
+
+import re
+import sys
+from array import array
+from collections import OrderedDict
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from vscode.rope import Rope
+
+__all__ = ("LineIndex", "TextSnapshot", "DocumentMirror", "DocumentStore", "TextCache")
+
+NEWLINE = re.compile("\n")
+
+
+def utf16_len(text: str) -> int:
+    return len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+
+
+def utf16_to_index(line: str, character: int) -> int:
+    """
+    Converts a character in a line, counted in UTF-16 code units, to an index of the line.
+    """
+    if line.isascii():
+        return min(character, len(line))
+
+    units = 0
+    for i, c in enumerate(line):
+        if units >= character:
+            return i
+        units += 2 if ord(c) > 0xFFFF else 1
+    return len(line)
+
+
+class LineIndex:
+    """
+    The offsets at which the lines of a text start, the line of an offset is found with a binary search.
+    """
+
+    def __init__(self, text: str = "") -> None:
+        self._starts = array("q", [0])
+        self._starts.extend(m.end() for m in NEWLINE.finditer(text))
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __getitem__(self, line: int) -> int:
+        return self._starts[line]
+
+    def line_of(self, offset: int) -> int:
+        """
+        The line that an offset is on.
+        """
+        return bisect_right(self._starts, offset) - 1
+
+
+class RopeLines:
+    """
+    The lines of a rope, looked up with the line breaks counted in its nodes.
+    This has the same interface as LineIndex.
+    """
+
+    def __init__(self, rope: Rope) -> None:
+        self.rope = rope
+
+    def __len__(self) -> int:
+        return self.rope.line_count
+
+    def __getitem__(self, line: int) -> int:
+        if line < 0:
+            line += self.rope.line_count
+        return self.rope.line_start(line)
+
+    def line_of(self, offset: int) -> int:
+        return self.rope.line_of(offset)
+
+
+class TextSnapshot:
+    """
+    The text of a document at a version, it doesn't change when the document is edited.
+
+    The text is held in a Rope so taking a snapshot of a synced document is free,
+    str(snapshot.rope) or get_text() return the whole text.
+    Snapshots of a string look lines up in a LineIndex and snapshots of a rope in the rope itself.
+    """
+
+    def __init__(self, uri: str, version: int, language_id: str, text: Union[str, Rope]) -> None:
+        self.uri = uri
+        self.version = version
+        self.language_id = language_id
+        self._rope = text if isinstance(text, Rope) else None
+        self._text = text if isinstance(text, str) else None
+        self._lines = None
+        self._utf16_starts = None  # The UTF-16 offsets of the lines of a str that isn't ASCII
+
+    def __repr__(self):
+        return f"<vscode.{self.__class__.__name__} {self.uri} version={self.version}>"
+
+    @property
+    def rope(self) -> Rope:
+        if self._rope is None:
+            self._rope = Rope(self._text)
+        return self._rope
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = str(self._rope)
+        return self._text
+
+    @property
+    def lines(self) -> Union[LineIndex, RopeLines]:
+        if self._lines is None:
+            self._lines = RopeLines(self._rope) if self._rope is not None else LineIndex(self._text)
+        return self._lines
+
+    def __len__(self) -> int:
+        return len(self._text) if self._text is not None else len(self._rope)
+
+    def slice(self, start: int, end: int) -> str:
+        if self._text is not None:
+            return self._text[start:end]
+        return self._rope.slice(start, end)
+
+    @property
+    def line_count(self) -> int:
+        return len(self.lines)
+
+    def line_bounds(self, line: int) -> Tuple[int, int]:
+        """
+        The start and end of a line in the text, without its line break.
+        """
+        lines = self.lines
+        line = min(max(line, 0), len(lines) - 1)
+        start = lines[line]
+        if line + 1 < len(lines):
+            end = lines[line + 1] - 1
+            if end > start and (self._text or self._rope)[end - 1] == "\r":
+                end -= 1
+        else:
+            end = len(self)
+        return start, end
+
+    def line_break_end(self, line: int) -> int:
+        """
+        The end of a line in the text, including its line break.
+        """
+        return self.lines[line + 1] if line + 1 < len(self.lines) else len(self)
+
+    def line_text(self, line: int) -> str:
+        return self.slice(*self.line_bounds(line))
+
+    def line_texts(self, start: int, end: int) -> List[str]:
+        """
+        The text of the lines from start up to end, without their line breaks.
+        """
+        return [self.line_text(line) for line in range(max(start, 0), min(end, self.line_count))]
+
+    def offset(self, line: int, character: int) -> int:
+        """
+        The index in the text of a position, positions outside the document are clamped to it.
+        """
+        if line < 0:
+            return 0
+        if line >= self.line_count:
+            return len(self)
+        if character <= 0:
+            return self.lines[line]
+        start, end = self.line_bounds(line)
+        return start + utf16_to_index(self.slice(start, end), max(character, 0))
+
+    def position(self, offset: int) -> Tuple[int, int]:
+        """
+        The line and UTF-16 character of an index in the text.
+        """
+        offset = min(max(offset, 0), len(self))
+        line = self.lines.line_of(offset)
+        start, end = self.line_bounds(line)
+        return line, utf16_len(self.slice(start, min(offset, end)))
+
+    def _utf16_lines(self) -> Optional[array]:
+        # None if every character is one UTF-16 code unit, a str isn't copied into a Rope for this
+        if self._utf16_starts is None:
+            starts = array("q")
+            if not self._text.isascii():
+                lines = self.lines
+                units = 0
+                for line in range(len(lines)):
+                    starts.append(units)
+                    units += utf16_len(self._text[lines[line] : self.line_break_end(line)])
+            self._utf16_starts = starts
+        return self._utf16_starts or None
+
+    def to_utf16(self, offset: int) -> int:
+        """
+        Converts an index in the text to an offset in UTF-16 code units, like the ones vscode uses.
+        """
+        if self._rope is not None:
+            return self._rope.to_utf16(offset)
+        starts = self._utf16_lines()
+        if starts is None:
+            return offset
+        offset = min(max(offset, 0), len(self._text))
+        line = self.lines.line_of(offset)
+        return starts[line] + utf16_len(self._text[self.lines[line] : offset])
+
+    def from_utf16(self, offset: int) -> int:
+        """
+        Converts an offset in UTF-16 code units to an index in the text.
+        An offset in the middle of a character is moved to the start of the next one.
+        """
+        if self._rope is not None:
+            return self._rope.from_utf16(offset)
+        starts = self._utf16_lines()
+        if starts is None:
+            return offset
+        line = max(bisect_right(starts, offset) - 1, 0)
+        start = self.lines[line]
+        return start + utf16_to_index(self._text[start : self.line_break_end(line)], offset - starts[line])
+
+    def get_text(self, range: Optional[Sequence[int]] = None) -> str:
+        """
+        Returns the text of the document or of a range given as [start line, start character, end line, end character].
+        """
+        if range is None:
+            return self.text
+        return self.slice(self.offset(range[0], range[1]), self.offset(range[2], range[3]))
+
+
+class DocumentMirror(TextSnapshot):
+    """
+    A copy of an open document that is edited as the document changes.
+    """
+
+    def __init__(self, uri: str, version: int, language_id: str, text: str) -> None:
+        super().__init__(uri, version, language_id, Rope(text))
+        self._text = text  # Until the first edit
+
+    def snapshot(self) -> TextSnapshot:
+        """
+        The current version of the document, it can be read while edits keep being applied.
+        """
+        snapshot = TextSnapshot(self.uri, self.version, self.language_id, self._rope)
+        snapshot._text = self._text
+        snapshot._lines = self._lines
+        return snapshot
+
+    def apply_changes(self, version: int, changes: List[list]) -> None:
+        """
+        Applies edits given as [start line, start character, end line, end character, text],
+        in the order vscode reported them.
+        """
+        for sl, sc, el, ec, text in changes:
+            start = self.offset(sl, sc)
+            end = self.offset(el, ec)
+            self._rope = self._rope.replace(start, end, text)
+            self._text = None
+            self._lines = None
+        self.version = version
+
+
+class DocumentStore:
+    """
+    The mirrors of the open documents by uri.
+    """
+
+    def __init__(self) -> None:
+        self.documents: Dict[str, DocumentMirror] = {}
+
+    def __contains__(self, uri: str) -> bool:
+        return uri in self.documents
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def get(self, uri: str) -> Optional[DocumentMirror]:
+        return self.documents.get(uri)
+
+    def clear(self) -> None:
+        self.documents.clear()
+
+    def handle(self, data: dict) -> None:
+        """
+        Updates the mirrors from a message sent by extension.js.
+        """
+        action = data["action"]
+        uri = data["uri"]
+        if action == "open":
+            self.documents[uri] = DocumentMirror(uri, data["version"], data["languageId"], data["text"])
+        elif action == "change":
+            document = self.documents.get(uri)
+            if document is not None:
+                document.apply_changes(data["version"], data["changes"])
+        elif action == "close":
+            self.documents.pop(uri, None)
+
+
+class TextCache:
+    """
+    The fetched texts of documents by uri and version.
+
+    The least recently used texts are evicted once they take more than max_bytes,
+    extension.js reports the versions of the cached documents so stale texts are never returned.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[Tuple[str, int], TextSnapshot]" = OrderedDict()
+        self.versions: Dict[str, int] = {}  # The last version extension.js reported for each uri
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def version(self, uri: str) -> Optional[int]:
+        return self.versions.get(uri)
+
+    def get(self, uri: str) -> Optional[TextSnapshot]:
+        """
+        The text of the current version of a document if it is cached.
+        """
+        key = (uri, self.versions.get(uri))
+        snapshot = self.entries.get(key)
+        if snapshot is not None:
+            self.entries.move_to_end(key)
+        return snapshot
+
+    def put(self, snapshot: TextSnapshot) -> None:
+        known = self.versions.get(snapshot.uri)
+        if known is not None and known > snapshot.version:
+            return  # The document changed while its text was being fetched
+        self.set_version(snapshot.uri, snapshot.version)
+        size = sys.getsizeof(snapshot.text)
+        if size > self.max_bytes:
+            return
+
+        # Two reads that missed at the same time put the same version twice
+        previous = self.entries.pop((snapshot.uri, snapshot.version), None)
+        if previous is not None:
+            self.size -= sys.getsizeof(previous.text)
+
+        self.entries[(snapshot.uri, snapshot.version)] = snapshot
+        self.size += size
+        while self.size > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= sys.getsizeof(evicted.text)
+
+    def set_version(self, uri: str, version: Optional[int]) -> None:
+        """
+        Records the version of a document, the text of any other version is dropped.
+        A version of None means the document was closed.
+        """
+        previous = self.versions.get(uri)
+        if previous != version:
+            snapshot = self.entries.pop((uri, previous), None)
+            if snapshot is not None:
+                self.size -= sys.getsizeof(snapshot.text)
+        if version is None:
+            self.versions.pop(uri, None)
+        else:
+            self.versions[uri] = version
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.versions.clear()
+        self.size = 0
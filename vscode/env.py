@@ -1,14 +1,31 @@
+from typing import Any, Dict
+
+# The python names of the properties of vscode.env
+PROPERTIES = {
+    "app_host": "appHost",
+    "app_name": "appName",
+    "app_root": "appRoot",
+    "is_new_app_install": "isNewAppInstall",
+    "is_telemetry_enabled": "isTelemetryEnabled",
+    "language": "language",
+    "machine_id": "machineId",
+    "remote_name": "remoteName",
+    "session_id": "sessionId",
+    "shell": "shell",
+    "ui_kind": "uiKind",
+    "uri_scheme": "uriScheme",
+}
+
+
 class Clipboard:
     def __init__(self, ws) -> None:
         self.ws = ws
 
     async def read(self):
-        return await self.ws.run_code("vscode.env.clipboard.readText()")
+        return await self.ws.call("readClipboard")
 
     async def write(self, text: str):
-        await self.ws.run_code(
-            f"vscode.env.clipboard.writeText(`{text}`)", wait_for_response=False
-        )
+        await self.ws.call("writeClipboard", text, wait_for_response=False)
 
 
 class Env:
@@ -17,7 +34,19 @@ class Env:
         self.clipboard = Clipboard(self.ws)
 
     async def _get_property(self, property):
-        return await self.ws.run_code(f"vscode.env.{property}", thenable=False)
+        if property in self.ws.env:
+            return self.ws.env[property]
+        return await self.ws.call("getEnv", property)
+
+    async def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns every property by its python name.
+        extension.js sends them when python connects and sends shell and is_telemetry_enabled again
+        when they change, so the properties are only fetched if that hasn't happened yet.
+        """
+        if not self.ws.env:
+            self.ws.env.update(await self.ws.call("getEnvSnapshot"))
+        return {name: self.ws.env.get(property) for name, property in PROPERTIES.items()}
 
     @property
     async def app_host(self):
@@ -68,4 +97,4 @@ class Env:
         return await self._get_property("uriScheme")
 
     async def open_external(self, uri) -> bool:
-        return await self.ws.run_code(f'vscode.env.openExternal("{uri}")')
+        return await self.ws.call("openExternal", str(uri))
@@ -0,0 +1,82 @@
+"""
+The vscode events that can be handled with the Extension.event decorator.
+
+extension.js only subscribes to the events the extension has handlers for, the compiler
+writes the subscriptions from this table. An event named change_text_document is
+handled by a function called on_change_text_document.
+"""
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from vscode.extension import Extension
+
+__all__ = ("EVENTS", "create_events_js")
+
+
+# Sent by extension.js once python has connected, it has no subscription
+BUILTIN_EVENTS = ("activate",)
+
+# name: (the vscode event, a function that turns its argument into the data python receives)
+EVENTS = {
+    # workspace
+    "open_text_document": ("vscode.workspace.onDidOpenTextDocument", "documentInfo"),
+    "close_text_document": ("vscode.workspace.onDidCloseTextDocument", "documentInfo"),
+    "save_text_document": ("vscode.workspace.onDidSaveTextDocument", "documentInfo"),
+    "change_text_document": (
+        "vscode.workspace.onDidChangeTextDocument",
+        """(e) => ({
+      document: documentInfo(e.document),
+      version: e.document.version,
+      changes: e.contentChanges.map((c) => ({ range: toRange(c.range), text: c.text })),
+    })""",
+    ),
+    "change_workspace_folders": (
+        "vscode.workspace.onDidChangeWorkspaceFolders",
+        """(e) => ({
+      added: e.added.map(folderInfo),
+      removed: e.removed.map(folderInfo),
+    })""",
+    ),
+    # window
+    "change_active_text_editor": ("vscode.window.onDidChangeActiveTextEditor", "editorInfo"),
+    "change_visible_text_editors": (
+        "vscode.window.onDidChangeVisibleTextEditors",
+        "(editors) => editors.map(editorInfo)",
+    ),
+    "change_text_editor_selection": (
+        "vscode.window.onDidChangeTextEditorSelection",
+        "(e) => ({ editor: editorInfo(e.textEditor), selections: e.selections.map(toRange), kind: e.kind })",
+    ),
+    "change_text_editor_visible_ranges": (
+        "vscode.window.onDidChangeTextEditorVisibleRanges",
+        "(e) => ({ editor: editorInfo(e.textEditor), visible_ranges: e.visibleRanges.map(toRange) })",
+    ),
+    "change_window_state": ("vscode.window.onDidChangeWindowState", "(e) => ({ focused: e.focused })"),
+    "open_terminal": ("vscode.window.onDidOpenTerminal", "terminalInfo"),
+    "close_terminal": ("vscode.window.onDidCloseTerminal", "terminalInfo"),
+    "change_active_terminal": ("vscode.window.onDidChangeActiveTerminal", "terminalInfo"),
+}
+
+
+def create_events_js(extension: "Extension") -> str:
+    subscriptions = []
+    for event in extension.events.values():
+        if event.name in BUILTIN_EVENTS:
+            continue
+        if event.name not in EVENTS:
+            print(
+                f"\033[1;33;49mWarning: on_{event.name} doesn't handle a known event, it will never be called.",
+                "\033[0m",
+            )
+            continue
+
+        source, serializer = EVENTS[event.name]
+        options = {"debounce": event.debounce_ms or 0, "batch": event.batch}
+        options = ", ".join(f"{key}: {str(value).lower()}" for key, value in options.items())
+        subscriptions.append(
+            f'    {source}(forwardEvent("{event.name}", {serializer}, {{ {options} }}))'
+        )
+
+    body = ",\n".join(subscriptions)
+    return f"function registerEvents(context) {{\n  context.subscriptions.push(\n{body}\n  );\n}}"
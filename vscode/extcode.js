@@ -1,32 +1,484 @@
 // Built using vscode.py
 const vscode = require("vscode");
-const { spawn, execSync } = require("child_process");
+const { spawn } = require("child_process");
 const path = require("path");
-const pythonExtensionPath = path.join(__dirname, "extension.py");
+const crypto = require("crypto");
 const requirementsPath = path.join(__dirname, "requirements.txt");
+const sitePackagesPath = path.join(__dirname, "site-packages");
+const packageJSON = require("./package.json");
 
 const wslib = require("ws");
 const fs = require("fs");
+const net = require("net");
+const TRANSPORT = "<transport>";
+const SYNC_DOCUMENTS = "<sync_documents>" == "true";
+let msgpack;
+try {
+  msgpack = require("@msgpack/msgpack");
+} catch (e) {}
+
 let ws;
+let connected = false;
+let binary = false;
+let queue = [];
+let progressRecords = {};
+// The documents python has cached the text of, it is told when their version changes
+let trackedDocuments = new Set();
+// The watcher that keeps the file index of python up to date, see watchFiles
+let fileWatcher;
+let fileEvents = [];
+// The paths of the dirty documents and the subscriptions that update them, see watchDirtyDocuments
+let dirtyDocuments;
+let dirtyWatchers = [];
+
+let handles = new Map();
+let handleIds = new WeakMap();
+let nextHandle = 1;
+// The editors that have a handle, vscode discards an editor once it is hidden
+let editors = new Set();
+
+function toHandle(obj) {
+  if (obj === undefined || obj === null) {
+    return null;
+  }
+  let handle = handleIds.get(obj);
+  if (handle === undefined) {
+    handle = nextHandle++;
+    handleIds.set(obj, handle);
+    handles.set(handle, obj);
+  }
+  return handle;
+}
+
+function releaseHandle(handle) {
+  let obj = handles.get(handle);
+  if (obj !== undefined) {
+    handles.delete(handle);
+    handleIds.delete(obj);
+  }
+}
+
+function releaseObject(obj) {
+  let handle = handleIds.get(obj);
+  if (handle !== undefined) {
+    releaseHandle(handle);
+  }
+}
+
+function documentInfo(document) {
+  return document ? { handle: toHandle(document), uri: document.uri.toString() } : null;
+}
+
+function editorInfo(editor) {
+  if (!editor) {
+    return null;
+  }
+  editors.add(editor);
+  return { handle: toHandle(editor), document: documentInfo(editor.document) };
+}
+
+function releaseHiddenEditors() {
+  let shown = new Set(vscode.window.visibleTextEditors);
+  shown.add(vscode.window.activeTextEditor);
+  for (const editor of editors) {
+    if (!shown.has(editor)) {
+      editors.delete(editor);
+      releaseObject(editor);
+    }
+  }
+}
+
+function terminalInfo(terminal) {
+  return terminal ? { handle: toHandle(terminal), name: terminal.name } : null;
+}
+
+function folderInfo(folder) {
+  return { index: folder.index, name: folder.name, uri: folder.uri.toString(), fsPath: folder.uri.fsPath };
+}
+
+function toRange(range) {
+  return [range.start.line, range.start.character, range.end.line, range.end.character];
+}
+
+function toRemote(value) {
+  // Documents, editors and terminals are sent as handles instead of being serialized
+  if (value && typeof value.getText == "function") {
+    return documentInfo(value);
+  } else if (value && value.document && value.selections) {
+    return editorInfo(value);
+  } else if (value && typeof value.sendText == "function") {
+    return terminalInfo(value);
+  }
+  return value;
+}
+
+// func: procedures
+
+function toPlain(value, depth = 0) {
+  // msgpack doesn't call toJSON, this produces what JSON.stringify would have serialized
+  if (value === null || typeof value != "object" || value instanceof Uint8Array || depth > 32) {
+    return value;
+  } else if (typeof value.toJSON == "function") {
+    return toPlain(value.toJSON(), depth + 1);
+  } else if (Array.isArray(value)) {
+    return value.map((v) => toPlain(v, depth + 1));
+  }
+  let obj = {};
+  for (const key of Object.keys(value)) {
+    let v = value[key];
+    if (v !== undefined && typeof v != "function") {
+      obj[key] = toPlain(v, depth + 1);
+    }
+  }
+  return obj;
+}
+
+function encode(data) {
+  return binary ? msgpack.encode(toPlain(data)) : JSON.stringify(data);
+}
+
+function decode(message) {
+  return binary ? msgpack.decode(message) : JSON.parse(message.toString());
+}
+
+function send(data) {
+  ws.send(encode(data));
+}
+
+class FramedSocket {
+  // Length prefixed frames over a stream, used like a websocket
+  constructor(socket) {
+    this.socket = socket;
+    this.readyState = 0;
+    this.listeners = { open: [], message: [], close: [] };
+    this.chunks = [];
+    this.length = 0;
+    this.expected = null;
+
+    socket.on("data", (chunk) => this.receive(chunk));
+    socket.on("close", () => {
+      this.readyState = 3;
+      this.emit("close");
+    });
+  }
+
+  on(event, callback) {
+    this.listeners[event].push(callback);
+  }
+
+  emit(event, ...args) {
+    for (const callback of this.listeners[event]) {
+      callback(...args);
+    }
+  }
+
+  open() {
+    this.readyState = 1;
+    this.emit("open");
+  }
+
+  send(data) {
+    let payload = typeof data == "string" ? Buffer.from(data) : data;
+    let header = Buffer.alloc(4);
+    header.writeUInt32BE(payload.length);
+    this.socket.write(header);
+    this.socket.write(payload);
+  }
+
+  take(n) {
+    let buffer = this.chunks.length == 1 ? this.chunks[0] : Buffer.concat(this.chunks, this.length);
+    let rest = buffer.subarray(n);
+    this.chunks = rest.length ? [rest] : [];
+    this.length = rest.length;
+    return buffer.subarray(0, n);
+  }
+
+  receive(chunk) {
+    this.chunks.push(chunk);
+    this.length += chunk.length;
+    while (true) {
+      if (this.expected === null) {
+        if (this.length < 4) {
+          return;
+        }
+        this.expected = this.take(4).readUInt32BE(0);
+      }
+      if (this.length < this.expected) {
+        return;
+      }
+      let message = this.take(this.expected);
+      this.expected = null;
+      this.emit("message", message);
+    }
+  }
+}
 
 function commandCallback(command) {
-  if (ws && ws.readyState == 1) {
-    ws.send(JSON.stringify({ type: 1, name: command }));
+  if (connected && ws.readyState == 1) {
+    send({ type: 1, name: command });
   } else {
-    setTimeout(() => commandCallback(command), 50);
+    // Sent once python has connected
+    queue.push({ type: 1, name: command });
   }
 }
 
-// func: registerCommands
+function sendEvent(name, data) {
+  if (connected && ws.readyState == 1) {
+    send({ type: 2, event: name, data });
+  }
+}
 
-function activate(context) {
-  registerCommands(context);
+// The configs the extension declares, without the extension name
+const configKeys = Object.keys(packageJSON.contributes?.configuration?.properties || {}).map((key) =>
+  key.slice(packageJSON.name.length + 1)
+);
+
+function sendConfiguration(keys) {
+  if (connected && keys.length) {
+    let configuration = vscode.workspace.getConfiguration(packageJSON.name);
+    // An unset value is sent as null, undefined would drop its key
+    send({ type: 7, values: Object.fromEntries(keys.map((key) => [key, configuration.get(key) ?? null])) });
+  }
+}
+
+// Only shell and isTelemetryEnabled change while vscode is running
+const ENV_PROPERTIES = [
+  "appHost",
+  "appName",
+  "appRoot",
+  "isNewAppInstall",
+  "isTelemetryEnabled",
+  "language",
+  "machineId",
+  "remoteName",
+  "sessionId",
+  "shell",
+  "uiKind",
+  "uriScheme",
+];
+
+function envSnapshot(names = ENV_PROPERTIES) {
+  return Object.fromEntries(names.map((name) => [name, vscode.env[name] ?? null]));
+}
+
+function sendEnv(names) {
+  if (connected) {
+    send({ type: 8, values: envSnapshot(names) });
+  }
+}
+
+function sendWorkspaceFolders() {
+  if (connected) {
+    send({ type: 9, folders: (vscode.workspace.workspaceFolders || []).map(folderInfo) });
+  }
+}
 
+// A save or a checkout fires many events at once, they are sent together after this delay
+const FILE_EVENTS_DELAY = 100;
+
+function queueFileEvent(kind, uri) {
+  if (uri.scheme == "file") {
+    if (!fileEvents.length) {
+      setTimeout(() => {
+        if (connected) {
+          send({ type: 10, events: fileEvents });
+        }
+        fileEvents = [];
+      }, FILE_EVENTS_DELAY);
+    }
+    fileEvents.push([kind, uri.fsPath]);
+  }
+}
+
+function watchFiles() {
+  if (!fileWatcher) {
+    fileWatcher = vscode.workspace.createFileSystemWatcher("**/*");
+    fileWatcher.onDidCreate((uri) => queueFileEvent("create", uri));
+    fileWatcher.onDidChange((uri) => queueFileEvent("change", uri));
+    fileWatcher.onDidDelete((uri) => queueFileEvent("delete", uri));
+  }
+}
+
+function updateDirty(document) {
+  if (document.uri.scheme == "file") {
+    let path = document.uri.fsPath;
+    let dirty = document.isDirty && !document.isClosed;
+    if (dirty != dirtyDocuments.has(path)) {
+      dirty ? dirtyDocuments.add(path) : dirtyDocuments.delete(path);
+      if (connected) {
+        send({ type: 11, path, dirty });
+      }
+    }
+  }
+}
+
+function watchDirtyDocuments() {
+  if (!dirtyDocuments) {
+    dirtyDocuments = new Set(
+      vscode.workspace.textDocuments.filter((d) => d.isDirty && d.uri.scheme == "file").map((d) => d.uri.fsPath)
+    );
+    dirtyWatchers.push(
+      vscode.workspace.onDidChangeTextDocument((e) => updateDirty(e.document)),
+      vscode.workspace.onDidSaveTextDocument(updateDirty),
+      vscode.workspace.onDidCloseTextDocument(updateDirty)
+    );
+  }
+  return [...dirtyDocuments];
+}
+
+function toUri(uri) {
+  return /^[a-zA-Z][a-zA-Z0-9+.-]+:/.test(uri) ? vscode.Uri.parse(uri) : vscode.Uri.file(uri);
+}
+
+// Bytes are sent as they are with msgpack and in base64 with json
+function sendableBytes(data) {
+  return binary ? data : Buffer.from(data.buffer, data.byteOffset, data.byteLength).toString("base64");
+}
+
+function receivedBytes(data) {
+  return typeof data == "string" ? Buffer.from(data, "base64") : data;
+}
+
+async function readFiles(uris) {
+  return Promise.all(
+    uris.map(async (uri) => {
+      uri = toUri(uri);
+      let document = vscode.workspace.textDocuments.find((d) => d.isDirty && d.uri.toString() == uri.toString());
+      return sendableBytes(document ? Buffer.from(document.getText()) : await vscode.workspace.fs.readFile(uri));
+    })
+  );
+}
+
+async function writeFiles(uris, contents) {
+  await Promise.all(uris.map((uri, i) => vscode.workspace.fs.writeFile(toUri(uri), receivedBytes(contents[i]))));
+}
+
+function syncable(document) {
+  // Output channels are documents too, they change far too often to be worth sending
+  return SYNC_DOCUMENTS && connected && document.uri.scheme != "output";
+}
+
+function sendOpenDocument(document) {
+  if (syncable(document)) {
+    let uri = document.uri.toString();
+    send({ type: 5, action: "open", uri, version: document.version, languageId: document.languageId, text: document.getText() });
+  }
+}
+
+function sendDocumentVersion(document, version) {
+  let uri = document.uri.toString();
+  if (connected && trackedDocuments.has(uri)) {
+    send({ type: 6, uri, version });
+  }
+}
+
+function registerDocumentSync(context) {
+  // The documents that aren't synced, like output channels, are fetched and cached by python
+  context.subscriptions.push(
+    vscode.workspace.onDidChangeTextDocument((e) => {
+      if (!syncable(e.document)) {
+        sendDocumentVersion(e.document, e.document.version);
+      }
+    }),
+    vscode.workspace.onDidCloseTextDocument((document) => {
+      if (!syncable(document)) {
+        sendDocumentVersion(document, null);
+      }
+      trackedDocuments.delete(document.uri.toString());
+    })
+  );
+  if (!SYNC_DOCUMENTS) {
+    return;
+  }
+  context.subscriptions.push(
+    vscode.workspace.onDidOpenTextDocument(sendOpenDocument),
+    vscode.workspace.onDidChangeTextDocument((e) => {
+      if (syncable(e.document) && e.contentChanges.length) {
+        let changes = e.contentChanges.map((c) => [...toRange(c.range), c.text]);
+        send({ type: 5, action: "change", uri: e.document.uri.toString(), version: e.document.version, changes });
+      }
+    }),
+    vscode.workspace.onDidCloseTextDocument((document) => {
+      if (syncable(document)) {
+        send({ type: 5, action: "close", uri: document.uri.toString() });
+      }
+    })
+  );
+}
+
+const MAX_BATCH = 1000;
+
+function forwardEvent(name, serialize, { debounce, batch }) {
+  // High frequency events can be debounced and sent as a list in a single message
+  let buffered = [];
+  let timer = null;
+  const flush = () => {
+    clearTimeout(timer);
+    timer = null;
+    sendEvent(name, batch ? buffered : buffered[0]);
+    buffered = [];
+  };
+
+  return (e) => {
+    if (!connected) {
+      return;
+    }
+    let data = serialize(e);
+    if (!debounce && !batch) {
+      sendEvent(name, data);
+      return;
+    }
+
+    if (batch) {
+      buffered.push(data);
+    } else {
+      buffered = [data];
+    }
+    if (batch && buffered.length >= MAX_BATCH) {
+      flush();
+    } else if (debounce) {
+      clearTimeout(timer);
+      timer = setTimeout(flush, debounce);
+    } else if (timer === null) {
+      timer = setTimeout(flush, 0);
+    }
+  };
+}
+
+function run(command, args) {
+  return new Promise((resolve, reject) => {
+    let proc = spawn(command, args);
+    proc.stdout.on("data", (data) => console.log(data.toString().trim()));
+    proc.stderr.on("data", (data) => console.error(data.toString().trim()));
+    proc.on("error", reject);
+    proc.on("close", (code) =>
+      code == 0 ? resolve() : reject(new Error(`${command} ${args.join(" ")} exited with code ${code}`))
+    );
+  });
+}
+
+function requirementsFingerprint(venvPath) {
+  // pyvenv.cfg holds the version of the interpreter the venv was created with
+  let hash = crypto.createHash("sha256");
+  hash.update(fs.readFileSync(requirementsPath));
+  let cfgPath = path.join(venvPath, "pyvenv.cfg");
+  if (fs.existsSync(cfgPath)) {
+    hash.update(fs.readFileSync(cfgPath));
+  }
+  return hash.digest("hex");
+}
+
+async function setupPython() {
   let pyVar = process.platform == "win32" ? "python" : "python3";
+  if (fs.existsSync(sitePackagesPath)) {
+    // Published extensions can ship their dependencies, there is nothing to install
+    return pyVar;
+  }
+
   let venvPath = path.join(__dirname, "./venv");
   let createvenvPath = path.join(venvPath, "createvenv.txt");
   if (!fs.existsSync(createvenvPath)) {
-    execSync(`${pyVar} -m venv ${venvPath}`);
+    await run(pyVar, ["-m", "venv", venvPath]);
     fs.writeFileSync(
       createvenvPath,
       "Delete this file only if you want to recreate the venv! Do not include this file when you package/publish the extension."
@@ -37,11 +489,156 @@ function activate(context) {
     venvPath,
     process.platform == "win32" ? "Scripts/python.exe" : "bin/python"
   );
-  execSync(`${pyVar} -m pip install -r ${requirementsPath}`);
 
-  let py = spawn(pyVar, [pythonExtensionPath, "--run-webserver"]);
-  let webviews = {};
-  let progressRecords = {};
+  // Dependencies are only installed when requirements.txt or the interpreter changed
+  let fingerprintPath = path.join(venvPath, "requirements.sha256");
+  let fingerprint = requirementsFingerprint(venvPath);
+  if (!fs.existsSync(fingerprintPath) || fs.readFileSync(fingerprintPath, "utf8") != fingerprint) {
+    await vscode.window.withProgress(
+      { location: vscode.ProgressLocation.Window, title: "Installing python dependencies" },
+      () => run(pyVar, ["-m", "pip", "install", "-r", requirementsPath])
+    );
+    fs.writeFileSync(fingerprintPath, fingerprint);
+  }
+  return pyVar;
+}
+
+function connect(socket) {
+  ws = socket;
+  ws.on("open", () => {
+    console.log("Connected!");
+    // The handshake is always json, it decides the format of every other message
+    let formats = msgpack ? ["json", "msgpack"] : ["json"];
+    ws.send(JSON.stringify({ type: 0, formats }));
+  });
+  ws.on("message", async (message) => {
+    if (!binary) {
+      console.log("received: %s", message.toString());
+    }
+    let data;
+    try {
+      data = decode(message);
+      if (data.type == 0) {
+        binary = data.format == "msgpack";
+        connected = true;
+        trackedDocuments.clear();
+        console.log(`Using the ${data.format} format`);
+        // Python has the open documents before anything can read them
+        vscode.workspace.textDocuments.forEach(sendOpenDocument);
+        sendConfiguration(configKeys);
+        sendEnv();
+        sendWorkspaceFolders();
+        send({ type: 2, event: "activate" });
+        for (const message of queue.splice(0)) {
+          send(message);
+        }
+      } else if (data.type == 1) {
+        eval(data.code);
+      } else if (data.type == 2) {
+        // A rejected thenable is reported with its uuid by the catch below
+        let res = await eval(data.code);
+        send({ type: 3, res, uuid: data.uuid });
+      } else if (data.type == 3) {
+        let res = eval(data.code);
+        send({ type: 3, res, uuid: data.uuid });
+      } else if (data.type == 4) {
+        // A code that throws gets an {error} result and its index is in failed
+        const failed = [];
+        const evalCode = async (code, i) => {
+          try {
+            if (typeof code != "string") {
+              return await procedures[code.fn](...code.args);
+            }
+            return await eval(code);
+          } catch (e) {
+            console.log(e);
+            failed.push(i);
+            return { error: String(e) };
+          }
+        };
+        let results = [];
+        if (data.sequential) {
+          for (const [i, code] of data.codes.entries()) {
+            results.push(await evalCode(code, i));
+          }
+        } else {
+          results = await Promise.all(data.codes.map(evalCode));
+        }
+        send({ type: 3, res: { results, failed }, uuid: data.uuid });
+      } else if (data.type == 5) {
+        let res = await procedures[data.fn](...data.args);
+        if (data.uuid) {
+          send({ type: 3, res, uuid: data.uuid });
+        }
+      }
+    } catch (e) {
+      console.log(e);
+      if (data && data.uuid) {
+        send({ type: 3, error: String(e), uuid: data.uuid });
+      }
+    }
+  });
+
+  ws.on("close", () => {
+    connected = false;
+    console.log("Connection closed!");
+  });
+}
+
+// func: events
+
+// func: registerCommands
+
+function activate(context) {
+  registerCommands(context);
+  registerEvents(context);
+  registerDocumentSync(context);
+  context.subscriptions.push(
+    vscode.workspace.onDidChangeConfiguration((e) => {
+      if (e.affectsConfiguration(packageJSON.name)) {
+        sendConfiguration(configKeys.filter((key) => e.affectsConfiguration(`${packageJSON.name}.${key}`)));
+      }
+    })
+  );
+  context.subscriptions.push(vscode.workspace.onDidChangeWorkspaceFolders(sendWorkspaceFolders), {
+    dispose: () => {
+      fileWatcher?.dispose();
+      dirtyWatchers.forEach((watcher) => watcher.dispose());
+    },
+  });
+  // Older versions of vscode don't have these events
+  if (vscode.env.onDidChangeShell) {
+    context.subscriptions.push(vscode.env.onDidChangeShell(() => sendEnv(["shell"])));
+  }
+  if (vscode.env.onDidChangeTelemetryEnabled) {
+    context.subscriptions.push(vscode.env.onDidChangeTelemetryEnabled(() => sendEnv(["isTelemetryEnabled"])));
+  }
+  context.subscriptions.push(
+    vscode.workspace.onDidCloseTextDocument(releaseObject),
+    vscode.window.onDidChangeVisibleTextEditors(releaseHiddenEditors),
+    vscode.window.onDidCloseTerminal(releaseObject)
+  );
+
+  setupPython()
+    .then(startPython)
+    .catch((e) => console.error(`Couldn't start the python script: ${e}`));
+}
+
+// extension.py is run as a module rather than a script so python loads its byte-compiled code
+const LAUNCHER =
+  "import sys, runpy; sys.path[0] = sys.argv.pop(1); runpy.run_module('extension', run_name='__main__', alter_sys=True)";
+
+function startPython(pyVar) {
+  // stdio and unix sockets aren't supported on windows
+  let transport = process.platform == "win32" ? "websocket" : TRANSPORT;
+  let env = process.env;
+  if (fs.existsSync(sitePackagesPath)) {
+    env = { ...env, PYTHONPATH: sitePackagesPath };
+  }
+  let py = spawn(pyVar, ["-c", LAUNCHER, __dirname, "--run-webserver", "--transport", transport], {
+    env,
+    stdio: ["pipe", "pipe", "pipe", transport == "stdio" ? "pipe" : "ignore"],
+  });
 
   py.stdout.on("data", (data) => {
     let mes = data.toString().trim();
@@ -50,37 +647,21 @@ function activate(context) {
     }
     let arr = mes.split(" ");
     if (arr.length == 3 && arr[arr.length - 1].startsWith("ws://localhost:")) {
-      ws = new wslib.WebSocket(arr[arr.length - 1]);
       console.log("Connecting to " + arr[arr.length - 1]);
-      ws.on("open", () => {
-        console.log("Connected!");
-        ws.send(JSON.stringify({ type: 2, event: "activate" }));
-      });
-      ws.on("message", async (message) => {
-        console.log("received: %s", message.toString());
-        try {
-          let data = JSON.parse(message.toString());
-          if (data.type == 1) {
-            eval(data.code);
-          } else if (data.type == 2) {
-            eval(
-              data.code +
-                `.then(res => ws.send(JSON.stringify({ type: 3, res, uuid: "${data.uuid}" })));`
-            );
-          } else if (data.type == 3) {
-            let res = eval(data.code);
-            ws.send(JSON.stringify({ type: 3, res, uuid: data.uuid }));
-          }
-        } catch (e) {
-          console.log(e);
-        }
-      });
-
-      ws.on("close", () => {
-        console.log("Connection closed!");
-      });
+      connect(new wslib.WebSocket(arr[arr.length - 1]));
+    } else if (arr.length == 3 && arr[arr.length - 1].startsWith("unix:")) {
+      console.log("Connecting to " + arr[arr.length - 1]);
+      let socket = new FramedSocket(net.createConnection(arr[arr.length - 1].slice(5)));
+      socket.socket.on("connect", () => socket.open());
+      connect(socket);
     }
   });
+
+  if (transport == "stdio") {
+    let socket = new FramedSocket(py.stdio[3]);
+    connect(socket);
+    socket.open();
+  }
   py.stderr.on("data", (data) => {
     console.error(`An Error occurred in the python script: ${data}`);
   });
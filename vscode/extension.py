@@ -1,14 +1,21 @@
+import os
 import sys
-import asyncio
-from typing import Any, Callable, Optional, List
+import inspect
+import collections
+from typing import Any, Awaitable, Callable, Dict, Optional, List, Union, TYPE_CHECKING
 
-from vscode.context import Context
-from vscode.wsclient import WSClient
-from vscode.compiler import build
+from vscode.transports import TRANSPORTS
 from vscode.config import Config
 from vscode.utils import *
 
-__all__ = ("ExtensionMetadata", "Extension", "Command")
+if TYPE_CHECKING:
+    from vscode.codec import Codec
+    from vscode.wsclient import WSClient
+
+__all__ = ("ExtensionMetadata", "Extension", "Command", "Event")
+
+EXECUTORS = ("thread", "process")
+COALESCE = ("latest", "drop")
 
 class ExtensionMetadata:
     """
@@ -63,22 +70,128 @@ class Extension:
     Represents a vscode extension.
     """
 
-    def __init__(self, name: str, *, metadata: Optional[ExtensionMetadata] = None, config: Optional[List[Config]] = None) -> None:
+    def __init__(
+        self,
+        name: str,
+        *,
+        metadata: Optional[ExtensionMetadata] = None,
+        config: Optional[List[Config]] = None,
+        binary: bool = False,
+        codec: Union[str, "Codec", None] = None,
+        max_threads: Optional[int] = None,
+        max_processes: Optional[int] = None,
+        sync_documents: bool = False,
+        text_cache_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        """
+        Args:
+            name:
+                The name of the extension.
+            metadata:
+                The metadata of the extension.
+            config:
+                The configurations the extension contributes.
+            binary:
+                Whether messages should be sent as MessagePack over binary frames instead of json.
+                This requires msgpack to be installed and is negotiated when extension.js connects.
+            codec:
+                The codec of the messages, a name like "orjson" or a vscode.codec.Codec.
+                By default orjson or msgspec are used when they are installed, see vscode.codec.get_codec.
+            max_threads:
+                The number of threads that run commands and events with executor="thread".
+            max_processes:
+                The number of processes that run commands and events with executor="process".
+            sync_documents:
+                Whether extension.js keeps python up to date with the text of the open documents,
+                reading them is then done without a round trip. See vscode.documents.
+            text_cache_bytes:
+                How much memory the texts of documents fetched from extension.js can take,
+                they are reused until the document changes. 0 disables caching.
+        """
         self.name = name.lower().replace(" ", "-")
         self.metadata = metadata if metadata is not None else ExtensionMetadata()
         self.display_name = name if metadata is None or metadata.display_name is None else metadata.display_name
 
         self.config = [] if config is None else config
         self.commands = []
+        self.command_map: Dict[str, Command] = {}
         self.events = {}
         self.default_category = None
         self.keybindings = []
-
-        self.ws = WSClient(self)
+        self.transport = "websocket"
+
+        self.binary = binary
+        self.codec = codec
+        self._ws = None
+
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self._executors = {}
+        self.sync_documents = sync_documents
+        self.text_cache_bytes = text_cache_bytes
+
+        self.message_handlers: Dict[int, Callable[[dict], Awaitable[None]]] = {
+            1: self.handle_command,
+            2: self.handle_event,
+            3: self.handle_response,
+            4: self.handle_webview_event,
+            6: self.handle_document_version,  # Also sent with sync, for the documents that aren't synced
+            7: self.handle_configuration,
+            8: self.handle_env,
+            9: self.handle_workspace_folders,
+            10: self.handle_file_events,
+            11: self.handle_dirty_document,
+        }
+        if sync_documents:
+            self.message_handlers[5] = self.handle_document_sync
 
     def __repr__(self):
         return f"<vscode.Extension {self.name}>"
 
+    @property
+    def ws(self) -> "WSClient":
+        # Created lazily so that building doesn't import asyncio and websockets
+        if self._ws is None:
+            from vscode.wsclient import WSClient
+
+            self._ws = WSClient(
+                self,
+                codec=self.codec,
+                binary=self.binary,
+                sync_documents=self.sync_documents,
+                text_cache_bytes=self.text_cache_bytes,
+            )
+        return self._ws
+
+    def get_executor(self, kind: str):
+        """
+        Returns the pool that runs handlers with the given executor, it is created the first time it is used.
+        The "io" pool has its own threads for the file reads and writes of Workspace.fs,
+        so a large batch of files doesn't hold up the commands that run with executor="thread".
+        """
+        if kind not in self._executors:
+            import concurrent.futures
+
+            if kind == "process":
+                pool = concurrent.futures.ProcessPoolExecutor(self.max_processes)
+            elif kind == "io":
+                pool = concurrent.futures.ThreadPoolExecutor(thread_name_prefix=f"{self.name}-io")
+            else:
+                pool = concurrent.futures.ThreadPoolExecutor(
+                    self.max_threads, thread_name_prefix=self.name
+                )
+            self._executors[kind] = pool
+        return self._executors[kind]
+
+    async def run_in_executor(self, kind: str, func: Callable, *args) -> Any:
+        """
+        Runs a regular function in the thread or process pool without blocking the event loop.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.get_executor(kind), func, *args)
+
     def register_command(
         self,
         func: Callable[..., Any],
@@ -87,6 +200,11 @@ class Extension:
         category: Optional[str] = None,
         keybind: Optional[str] = None,
         when: Optional[str] = None,
+        executor: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        debounce_ms: Optional[float] = None,
+        throttle_ms: Optional[float] = None,
+        coalesce: Optional[str] = None,
     ) -> None:
         """
         Register a command.
@@ -107,13 +225,31 @@ class Extension:
                 The keybind for this command.
             when: 
                 A condition for when keybinds should be functional.
+            executor:
+                Where a regular function is run, see Command.
+            max_concurrency, debounce_ms, throttle_ms, coalesce:
+                Limits on how often the command runs, see Command.
         """
         name = func.__name__ if name is None else name
         category = self.default_category if category is None else category
-        command = Command(name, func, self, title, category, keybind, when)
+        command = Command(
+            name,
+            func,
+            self,
+            title,
+            category,
+            keybind,
+            when,
+            executor,
+            max_concurrency=max_concurrency,
+            debounce_ms=debounce_ms,
+            throttle_ms=throttle_ms,
+            coalesce=coalesce,
+        )
         if keybind:
             self.register_keybind(command)
         self.commands.append(command)
+        self.command_map.setdefault(command.name, command)
 
     def command(
         self,
@@ -122,6 +258,11 @@ class Extension:
         category: Optional[str] = None,
         keybind: Optional[str] = None,
         when: Optional[str] = None,
+        executor: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        debounce_ms: Optional[float] = None,
+        throttle_ms: Optional[float] = None,
+        coalesce: Optional[str] = None,
     ):
         """
         A decorator for registering commands.
@@ -139,10 +280,26 @@ class Extension:
                 The keybind for this command.
             when: 
                 A condition for when keybinds should be functional.
+            executor:
+                Where a regular function is run, see Command.
+            max_concurrency, debounce_ms, throttle_ms, coalesce:
+                Limits on how often the command runs, see Command.
         """
 
         def decorator(func):
-            self.register_command(func, name, title, category, keybind, when)
+            self.register_command(
+                func,
+                name,
+                title,
+                category,
+                keybind,
+                when,
+                executor,
+                max_concurrency=max_concurrency,
+                debounce_ms=debounce_ms,
+                throttle_ms=throttle_ms,
+                coalesce=coalesce,
+            )
             return func
 
         return decorator
@@ -156,13 +313,44 @@ class Extension:
             keybind.update({"when": command.when})
         self.keybindings.append(keybind)
 
-    def event(self, func: Callable):
+    def event(
+        self,
+        func: Optional[Callable] = None,
+        *,
+        executor: Optional[str] = None,
+        debounce_ms: Optional[float] = None,
+        batch: bool = False,
+    ):
         """
         A decorator for registering event handlers.
+        It can be used as @ext.event or with options as @ext.event(debounce_ms=100).
+        The events that can be handled are listed in vscode.events.EVENTS.
+
+        Args:
+            executor:
+                Where a regular function is run, see Command.
+            debounce_ms:
+                extension.js waits until the event hasn't fired for this long before sending it.
+            batch:
+                Whether the handler is passed a list of all the events fired while debouncing
+                instead of only the last one.
         """
-        name = func.__name__.replace("on_", "").lower()
-        self.events[name] = func
-        return func
+
+        def decorator(func):
+            event = Event(
+                func.__name__.replace("on_", ""),
+                func,
+                self,
+                executor,
+                debounce_ms=debounce_ms,
+                batch=batch,
+            )
+            self.events[event.name] = event
+            return func
+
+        if func is not None:
+            return decorator(func)
+        return decorator
 
 
     def set_default_category(self, category) -> None:
@@ -173,45 +361,130 @@ class Extension:
         """
         self.default_category = category
 
-    def run(self):
-        if len(sys.argv) > 1:
-            if sys.argv[1] == "--run-webserver":
-                self.ws.run_webserver()
-            elif sys.argv[1] == "--build":
+    def run(self, transport: str = "websocket"):
+        """
+        Builds or runs the extension depending on the command line arguments.
+
+        Args:
+            transport:
+                How extension.js talks to python, one of "websocket", "stdio" or "unix".
+                stdio and unix send length prefixed frames over a pipe or a unix domain socket,
+                extension.js uses websockets instead of them on Windows.
+        """
+        if transport not in TRANSPORTS:
+            raise ValueError(f"transport must be one of {TRANSPORTS}")
+
+        self.transport = transport
+        if "multiprocessing" in sys.modules and sys.modules["multiprocessing"].parent_process():
+            # The extension file is imported again by the workers of the process pool
+            return
+
+        option = sys.argv[1] if len(sys.argv) > 1 else "--build"
+        if option == "--run-webserver":
+            if "--transport" in sys.argv:
+                transport = sys.argv[sys.argv.index("--transport") + 1]
+            self.ws.serve(transport)
+        elif option == "--import-time":
+            self.ws  # Imports what --run-webserver needs without running anything
+        elif option in ("--build", "--publish"):
+            # The compiler is only imported when building to keep startup fast
+            from vscode.compiler import build
+
+            if option == "--publish":
+                build(self, publish=True, vendor="--no-vendor" not in sys.argv)
+            else:
                 build(self)
-            elif sys.argv[1] == "--publish":
-                build(self, publish=True)
-        else:
-            build(self)
+
+    def add_message_handler(self, type: int, handler: Callable[[dict], Awaitable[None]]) -> None:
+        """
+        Registers the coroutine that handles messages of a type sent by extension.js.
+        This replaces the existing handler of that type.
+        """
+        self.message_handlers[type] = handler
 
     async def parse_ws_data(self, data: dict):
-        if data["type"] == 1: # Command 
-            name = data.get("name")
-            if any(name == (cmd:=i).name for i in self.commands):
-                ctx = Context(ws=self.ws)
-                ctx.command = cmd
-                asyncio.create_task(cmd.func(ctx))
+        handler = self.message_handlers.get(data.get("type"))
+        if handler is not None:
+            await handler(data)
+        else:  # Unrecognized
+            print(data, flush=True)
+
+    async def handle_command(self, data: dict):
+        from vscode.context import Context
+
+        name = data.get("name")
+        cmd = self.command_map.get(name)
+        if cmd is not None:
+            ctx = Context(ws=self.ws)
+            ctx.command = cmd
+            cmd.dispatch(ctx)
+        else:
+            print(f"Invalid Command '{name}'", flush=True)
+
+    async def handle_event(self, data: dict):
+        import asyncio
+
+        event = self.events.get(data.get("event").lower())
+        if event is not None:
+            if "data" in data:
+                asyncio.create_task(event.invoke(data["data"]))
             else:
-                print(f"Invalid Command '{name}'", flush=True)
-
-        elif data["type"] == 2: # Event
-            event = data.get("event").lower()
-            if event in self.events:
-                event_data = data.get("data")
-                coro = self.events[event]
-                if event_data:
-                    coro = coro(event_data)
-                else:
-                    coro = coro()
+                asyncio.create_task(event.invoke())
 
-                asyncio.create_task(coro)
+    async def handle_response(self, data: dict):
+        self.ws.resolve_response(data["uuid"], data.get("res", None), data.get("error"))
 
-        elif data["type"] == 3: # Eval Response:
-            self.ws.responses[data["uuid"]] = data.get("res", None)
-        elif data["type"] == 4: # Webview Event
-            asyncio.create_task(self.ws.webviews[data["id"]].handle_event(data["name"], data.get("data", None)))
-        else: # Unrecognized 
-            print(data, flush=True)
+    async def handle_webview_event(self, data: dict):
+        import asyncio
+
+        webview = self.ws.webviews[data["id"]]
+        asyncio.create_task(webview.handle_event(data["name"], data.get("data", None)))
+
+    async def handle_document_sync(self, data: dict):
+        self.ws.documents.handle(data)
+
+    async def handle_document_version(self, data: dict):
+        self.ws.text_cache.set_version(data["uri"], data["version"])
+
+    async def handle_configuration(self, data: dict):
+        self.ws.config.update(data["values"])
+
+    async def handle_env(self, data: dict):
+        self.ws.env.update(data["values"])
+
+    async def handle_workspace_folders(self, data: dict):
+        from vscode.workspace import WorkspaceFolders
+
+        self.ws.workspace_folders = WorkspaceFolders.from_list(data["folders"])
+        self.ws.file_index = None  # It is scanned again for the new folders when it is used
+
+    async def handle_file_events(self, data: dict):
+        import asyncio
+
+        index = self.ws.file_index
+        if index is not None:
+            # The paths are checked in a thread so messages keep being handled meanwhile,
+            # each update waits for the previous one so they are applied in order
+            index.updated = asyncio.ensure_future(
+                self._update_file_index(index, index.updated, data["events"])
+            )
+
+    async def _update_file_index(self, index, previous: Optional["asyncio.Future"], events: list):
+        import asyncio
+
+        changes = await self.run_in_executor("thread", index.resolve, events)
+        if previous is not None:
+            await asyncio.wait([previous])
+        index.apply(changes)
+
+    async def handle_dirty_document(self, data: dict):
+        dirty = self.ws.dirty_documents
+        if dirty is not None:
+            path = os.path.normcase(data["path"])
+            if data["dirty"]:
+                dirty.add(path)
+            else:
+                dirty.discard(path)
 
 
 class Command:
@@ -230,6 +503,11 @@ class Command:
         category: Optional[str] = None,
         keybind: Optional[str] = None,
         when: Optional[str] = None,
+        executor: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        debounce_ms: Optional[float] = None,
+        throttle_ms: Optional[float] = None,
+        coalesce: Optional[str] = None,
     ):
         """
         Initialize a command.
@@ -248,24 +526,141 @@ class Command:
                 The keybind for this command.
             when: 
                 A condition for when keybinds should be functional.
+            executor:
+                Where a regular function is run so that it doesn't block the event loop,
+                either "thread" (the default) or "process".
+                In a thread the function is passed the Context, coroutines of the context
+                can be run with Context.sync.
+                In a process the function is called without arguments, so it must be picklable.
+                If the function returns a Showable (a message, quick pick...) it is shown.
+            max_concurrency:
+                The number of invocations that can run at once.
+            debounce_ms:
+                Waits until the command hasn't been invoked for this long and only runs the last invocation.
+            throttle_ms:
+                The minimum time between the start of two invocations.
+            coalesce:
+                What happens to invocations that are over the limits.
+                By default they wait for their turn, with "drop" they are ignored and with
+                "latest" the newest one replaces the others: a waiting invocation is
+                superseded and the oldest running one is cancelled.
+                If max_concurrency isn't given, it is 1 when coalesce is set.
         """
 
         self.name = snake_case_to_camel_case(name)
         self.title = snake_case_to_title_case(title or name)
         self.ext = ext
 
-        if not asyncio.iscoroutinefunction(func):
-            raise TypeError("Callback must be a coroutine.")
-
+        self.executor = check_executor(func, executor)
         self.func = func
         self.func_name = self.func.__name__
         self.category = None if category is False else category
         self.keybind = keybind.upper() if keybind is not None else None
         self.when = python_condition_to_js_condition(when)
 
+        if coalesce is not None and coalesce not in COALESCE:
+            raise ValueError(f"coalesce must be one of {COALESCE}")
+        if max_concurrency is None and coalesce is not None:
+            max_concurrency = 1
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.max_concurrency = max_concurrency
+        self.debounce_ms = debounce_ms
+        self.throttle_ms = throttle_ms
+        self.coalesce = coalesce
+
+        self._running = []  # Oldest first
+        self._waiting = collections.deque()
+        self._timers = set()
+        self._latest = None  # The timer of the invocation that supersedes the others
+        self._next_start = 0.0
+
     def __repr__(self):
         return f"<vscode.Command {self.name}>"
 
+    def dispatch(self, ctx) -> None:
+        """
+        Schedules an invocation of the command, applying its debounce, throttle and concurrency limits.
+        """
+        if self.debounce_ms is not None:
+            self._supersede(ctx, self.debounce_ms / 1000, self._throttle)
+        else:
+            self._throttle(ctx)
+
+    def _throttle(self, ctx) -> None:
+        if self.throttle_ms is None:
+            self._start(ctx)
+            return
+
+        import asyncio
+
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next_start)
+        if start > now:
+            if self.coalesce == "drop":
+                return
+            if self.coalesce == "latest":
+                # Runs again once the interval is over, when it is let through
+                self._supersede(ctx, start - now, self._throttle)
+                return
+
+        self._next_start = start + self.throttle_ms / 1000
+        if start > now:
+            self._later(start - now, self._start, ctx)
+        else:
+            self._start(ctx)
+
+    def _start(self, ctx) -> None:
+        if self.max_concurrency is not None and len(self._running) >= self.max_concurrency:
+            if self.coalesce == "drop":
+                return
+            if self.coalesce == "latest":
+                self._running.pop(0).cancel()
+            else:
+                self._waiting.append(ctx)
+                return
+
+        import asyncio
+
+        task = asyncio.create_task(self.invoke(ctx))
+        self._running.append(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task) -> None:
+        if task in self._running:
+            self._running.remove(task)
+        if self._waiting and len(self._running) < self.max_concurrency:
+            self._start(self._waiting.popleft())
+
+    def _later(self, delay: float, callback: Callable, ctx) -> "asyncio.Task":
+        import asyncio
+
+        async def timer():
+            await asyncio.sleep(delay)
+            callback(ctx)
+
+        task = asyncio.create_task(timer())
+        self._timers.add(task)
+        task.add_done_callback(self._timers.discard)
+        return task
+
+    def _supersede(self, ctx, delay: float, callback: Callable) -> None:
+        if self._latest is not None:
+            self._latest.cancel()
+        self._latest = self._later(delay, callback, ctx)
+
+    async def invoke(self, ctx) -> None:
+        if self.executor is None:
+            await self.func(ctx)
+            return
+
+        if self.executor == "process":
+            result = await self.ext.run_in_executor("process", self.func)
+        else:
+            result = await self.ext.run_in_executor("thread", self.func, ctx)
+        await show_result(ctx, result)
+
     @property
     def extension_string(self) -> str:
         return f"{self.ext.name}.{self.name}"
@@ -275,3 +670,77 @@ class Command:
         if self.category is not None:
             cmd.update({"category": self.category})
         return cmd
+
+
+class Event:
+    """
+    An event handler registered with the Extension.event decorator.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        ext: Extension,
+        executor: Optional[str] = None,
+        debounce_ms: Optional[float] = None,
+        batch: bool = False,
+    ):
+        """
+        Args:
+            name:
+                The name of the event without the on_ prefix.
+            func:
+                The function that handles the event.
+            ext:
+                The extension this event is registered in.
+            executor:
+                Where a regular function is run, see Command.
+            debounce_ms:
+                How long extension.js waits for the event to stop firing before sending it.
+            batch:
+                Whether the events fired while debouncing are sent as a list.
+        """
+        self.name = name.lower()
+        self.ext = ext
+        self.executor = check_executor(func, executor)
+        self.func = func
+        self.debounce_ms = debounce_ms
+        self.batch = batch
+
+    def __repr__(self):
+        return f"<vscode.Event {self.name}>"
+
+    async def invoke(self, *args) -> None:
+        if self.executor is None:
+            await self.func(*args)
+            return
+
+        result = await self.ext.run_in_executor(self.executor, self.func, *args)
+        if result is not None:
+            from vscode.context import Context
+
+            await show_result(Context(ws=self.ext.ws), result)
+
+
+def check_executor(func: Callable, executor: Optional[str]) -> Optional[str]:
+    """
+    Returns the executor a handler runs in, None if it is a coroutine that runs on the event loop.
+    """
+    if inspect.iscoroutinefunction(func):
+        if executor is not None:
+            raise TypeError("executor can only be used with regular functions, not coroutines.")
+        return None
+
+    if executor is None:
+        return "thread"
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {EXECUTORS}")
+    return executor
+
+
+async def show_result(ctx, result: Any) -> None:
+    from vscode.window import Showable
+
+    if isinstance(result, Showable):
+        await ctx.show(result)
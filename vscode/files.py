@@ -0,0 +1,479 @@
+"""
+An index of the files in the workspace folders, see Workspace.get_file_index.
+
+The folders are scanned once with os.scandir in a thread pool, after that extension.js
+watches them with a FileSystemWatcher and sends the files that were created, changed
+or deleted in batches. Queries are answered from the index without a round trip.
+"""
+
+import os
+import re
+import sys
+import heapq
+import itertools
+from functools import lru_cache
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+__all__ = ("FileIndex", "glob_to_regex")
+
+# Directories that are never indexed
+EXCLUDE = (".git", ".hg", ".svn", "node_modules", "__pycache__")
+
+SEP = "/" if os.sep == "/" else r"[\\/]"
+NOT_SEP = r"[^/\n]" if os.sep == "/" else r"[^\\/\n]"
+FLAGS = re.MULTILINE | (re.IGNORECASE if os.name == "nt" else 0)
+
+
+def _split_braces(pattern: str) -> List[str]:
+    # Splits the inside of {a,b} on the commas that aren't in nested braces
+    parts = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(pattern):
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append(pattern[start:i])
+            start = i + 1
+    parts.append(pattern[start:])
+    return parts
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translates a glob pattern like the ones vscode.workspace.findFiles takes to a regex.
+    ** matches any number of directories, * and ? match within a name, {a,b} matches
+    either alternative and [abc] or [!abc] match a character.
+    """
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**", i):
+            if pattern.startswith("**/", i):
+                out.append(f"(?:[^\\n]*{SEP})?")
+                i += 3
+                continue
+            out.append("[^\\n]*")
+            i += 2
+        elif c == "*":
+            out.append(f"{NOT_SEP}*")
+            i += 1
+        elif c == "?":
+            out.append(NOT_SEP)
+            i += 1
+        elif c == "/":
+            out.append(SEP)
+            i += 1
+        elif c == "{":
+            depth = 0
+            for end in range(i, n):
+                depth += {"{": 1, "}": -1}.get(pattern[end], 0)
+                if depth == 0:
+                    break
+            if depth:
+                out.append(re.escape(c))
+                i += 1
+                continue
+            alternatives = _split_braces(pattern[i + 1 : end])
+            out.append("(?:" + "|".join(glob_to_regex(a) for a in alternatives) + ")")
+            i = end + 1
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+                i += 1
+                continue
+            chars = pattern[i + 1 : end]
+            if chars[0] == "!":
+                chars = "^" + chars[1:]
+            out.append("[" + chars.replace("\\", "\\\\") + "]")
+            i = end + 1
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return "".join(out)
+
+
+@lru_cache(maxsize=128)
+def _compile(pattern: str, flags: int = FLAGS) -> "re.Pattern":
+    return re.compile(pattern, flags)
+
+
+def _split_pattern(pattern: str) -> Tuple[str, str]:
+    # Splits a glob pattern at its last / that isn't in braces or brackets
+    depth = 0
+    split = -1
+    for i, c in enumerate(pattern):
+        if c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth = max(depth - 1, 0)
+        elif c == "/" and depth == 0:
+            split = i
+    return pattern[:split] if split != -1 else "", pattern[split + 1 :]
+
+
+def _subsequence(query: str, text: str) -> bool:
+    # str.find never goes back, so this is linear in the length of text
+    index = -1
+    for c in query:
+        index = text.find(c, index + 1)
+        if index == -1:
+            return False
+    return True
+
+
+class FileIndex:
+    """
+    The paths of the files under some root directories.
+
+    The index maps every directory to the names of its files and every name to the
+    directories that have a file with that name. Names like index.js or __init__.py are
+    repeated across a repository so each one is only stored once.
+
+    A glob pattern is split into a directory part and a name part that are matched
+    against the directories and the distinct names, which are joined in one string so
+    that it is a single regex search that runs in C. Only the files in both are listed.
+    Those strings are rebuilt when a directory or a name is added or removed.
+
+    At most max_files files are indexed, truncated is True if there were more.
+    """
+
+    def __init__(
+        self,
+        roots: Sequence[str],
+        exclude: Sequence[str] = EXCLUDE,
+        max_files: int = 1_000_000,
+        workers: Optional[int] = None,
+    ) -> None:
+        self.roots = [os.path.normpath(root) for root in roots]
+        self.exclude = frozenset(exclude)
+        self.max_files = max_files
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.truncated = False
+        self.ready = False
+        self.scanned = None  # The future of the scan started by Workspace.get_file_index
+        self.updated = None  # The future of the last update, see Extension.handle_file_events
+        self._dirs: Dict[str, List[str]] = {}
+        self._names: Dict[str, List[str]] = {}
+        self._count = 0
+        self._pending: List[tuple] = []  # Changes that arrived while scanning
+
+        # The joined directories and names and the results of the searches in them
+        self._joined_dirs: Optional[str] = None
+        self._joined_names: Optional[str] = None
+        self._dir_matches: Dict[str, Tuple[Set[str], int]] = {}
+        self._name_matches: Dict[str, Tuple[List[str], int]] = {}
+        # The names and the directories relative to their root in lowercase, for fuzzy
+        self._lowered_names: Optional[List[Tuple[str, str]]] = None
+        self._lowered_dirs: Optional[List[Tuple[str, str]]] = None
+
+        roots = "|".join(re.escape(os.path.join(root, "")) for root in self.roots)
+        self._prefix = f"^(?:{roots})" if self.roots else "^(?!)"
+
+    def __repr__(self):
+        return f"<vscode.FileIndex roots={self.roots} files={len(self)}>"
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, path: str) -> bool:
+        directory, name = os.path.split(os.path.normpath(path))
+        return name in self._dirs.get(directory, ())
+
+    def __iter__(self) -> Iterator[str]:
+        for directory, names in self._dirs.items():
+            for name in names:
+                yield directory + os.sep + name
+
+    def _scan_dir(self, path: str) -> Tuple[str, List[str], List[str]]:
+        names = []
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in self.exclude:
+                                subdirs.append(entry.path)
+                        else:
+                            names.append(entry.name)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return path, names, subdirs
+
+    def _walk(self, paths: Sequence[str]) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Yields the directories under paths with the names of their files, as they are read.
+        os.scandir releases the GIL so the directories are read in parallel in a thread pool.
+        """
+        pending = set()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="FileIndex") as pool:
+            try:
+                for path in paths:
+                    pending.add(pool.submit(self._scan_dir, path))
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path, names, subdirs = future.result()
+                        pending.update(pool.submit(self._scan_dir, subdir) for subdir in subdirs)
+                        yield path, names
+            finally:  # The walk was stopped
+                for future in pending:
+                    future.cancel()
+
+    def scan(self) -> None:
+        """
+        Adds the files under the roots to the index.
+        This blocks, it is run in a thread by Workspace.get_file_index.
+        """
+        for path, names in self._walk(self.roots):
+            if path in self._dirs:  # When a root is in another root
+                continue
+            if self._count + len(names) > self.max_files:
+                self.truncated = True
+                break
+            self._add_dir(path)
+            for name in names:
+                self._add_file(path, name, check=False)
+
+    def flush(self) -> None:
+        """
+        Marks the scan as done and applies the changes that arrived during it.
+        """
+        self.ready = True
+        changes, self._pending = self._pending, []
+        self.apply(changes)
+
+    def _names_changed(self) -> None:
+        self._joined_names = None
+        self._lowered_names = None
+
+    def _dirs_changed(self) -> None:
+        self._joined_dirs = None
+        self._lowered_dirs = None
+
+    def _add_dir(self, directory: str) -> None:
+        if directory not in self._dirs:
+            self._dirs[directory] = []
+            self._dirs_changed()
+
+    def _add_file(self, directory: str, name: str, check: bool = True) -> None:
+        # The files are kept in lists, they take a fraction of the memory of sets
+        names = self._dirs[directory]
+        if check and name in names:
+            return
+        if self._count >= self.max_files:
+            self.truncated = True
+            return
+        name = sys.intern(name)  # So a name is stored once however many directories have it
+        dirs = self._names.get(name)
+        if dirs is None:
+            dirs = self._names[name] = []
+            self._names_changed()
+        names.append(name)
+        dirs.append(directory)
+        self._count += 1
+
+    def _remove_file(self, directory: str, name: str) -> None:
+        self._dirs[directory].remove(name)
+        dirs = self._names[name]
+        dirs.remove(directory)
+        if not dirs:
+            del self._names[name]
+            self._names_changed()
+        self._count -= 1
+
+    def _root_of(self, path: str) -> Optional[str]:
+        for root in self.roots:
+            if path.startswith(root) and path[len(root) : len(root) + 1] in ("", os.sep):
+                return root
+        return None
+
+    def _remove(self, path: str) -> None:
+        directory, name = os.path.split(path)
+        if name in self._dirs.get(directory, ()):
+            self._remove_file(directory, name)
+            return
+
+        # A deleted directory is reported without its contents
+        subtree = os.path.join(path, "")
+        for directory in [d for d in self._dirs if d == path or d.startswith(subtree)]:
+            for name in list(self._dirs[directory]):
+                self._remove_file(directory, name)
+            del self._dirs[directory]
+            self._dirs_changed()
+
+    def resolve(self, events: List[list]) -> List[tuple]:
+        """
+        Turns events given as [kind, path], where kind is "create", "change" or "delete",
+        into the changes that apply makes to the index.
+
+        This checks which paths are directories and reads the ones that were created so it blocks,
+        it is run in a thread and doesn't modify the index.
+        """
+        changes = []
+        for kind, path in events:
+            path = os.path.normpath(path)
+            if kind == "delete":
+                changes.append(("delete", path))
+                continue
+
+            root = self._root_of(path)
+            if root is None or path == root:
+                continue
+            if not self.exclude.isdisjoint(path[len(root) + 1 :].split(os.sep)[:-1]):
+                continue
+            if not os.path.isdir(path):
+                changes.append(("file", path))
+            elif kind == "create" and os.path.basename(path) not in self.exclude:
+                changes.append(("tree", path, list(self._walk([path]))))
+        return changes
+
+    def apply(self, changes: List[tuple]) -> None:
+        """
+        Applies the changes returned by resolve, they are kept until the scan is done.
+        This doesn't block.
+        """
+        if not self.ready:
+            self._pending.extend(changes)
+            return
+
+        for change in changes:
+            kind, path = change[:2]
+            if kind == "delete":
+                self._remove(path)
+            elif kind == "file":
+                directory, name = os.path.split(path)
+                self._add_dir(directory)
+                self._add_file(directory, name)
+            else:
+                for directory, names in change[2]:
+                    self._add_dir(directory)
+                    for name in names:
+                        self._add_file(directory, name)
+
+    def _match_dirs(self, regex: str) -> Tuple[Set[str], int]:
+        """
+        The directories that match a regex and roughly how many files they have.
+        """
+        # The directories are joined with a separator at their end so the root matches an empty pattern
+        if self._joined_dirs is None:
+            self._joined_dirs = "\n".join(directory + os.sep for directory in self._dirs)
+            self._dir_matches.clear()
+        result = self._dir_matches.get(regex)
+        if result is None:
+            pattern = _compile(self._prefix + regex + "$")
+            matches = {directory[:-1] for directory in pattern.findall(self._joined_dirs)}
+            result = self._dir_matches[regex] = (matches, sum(len(self._dirs[d]) for d in matches))
+        return result
+
+    def _match_names(self, regex: str) -> Tuple[List[str], int]:
+        """
+        The names that match a regex and roughly how many files have them.
+        """
+        if self._joined_names is None:
+            self._joined_names = "\n".join(self._names)
+            self._name_matches.clear()
+        result = self._name_matches.get(regex)
+        if result is None:
+            pattern = _compile("^" + regex + "$")
+            matches = [name for name in pattern.findall(self._joined_names) if name]
+            result = self._name_matches[regex] = (matches, sum(len(self._names[n]) for n in matches))
+        return result
+
+    def _files(self, dirs: Tuple[Set[str], int], names: Tuple[List[str], int]) -> Iterator[str]:
+        # Lists the files from the side that has the fewest of them,
+        # the counts are from when the matches were cached so they are only an estimate
+        (dirs, from_dirs), (names, from_names) = dirs, names
+        if from_names <= from_dirs:
+            for name in names:
+                for directory in self._names[name]:
+                    if directory in dirs:
+                        yield directory + os.sep + name
+        else:
+            names = set(names)
+            for directory in dirs:
+                for name in self._dirs[directory]:
+                    if name in names:
+                        yield directory + os.sep + name
+
+    def glob(self, pattern: str, limit: Optional[int] = None) -> List[str]:
+        """
+        The files whose path relative to their root matches a glob pattern, see glob_to_regex.
+        """
+        head, tail = _split_pattern(pattern)
+        if tail == "**":
+            head, tail = f"{head}/**" if head else "**", "*"
+
+        if "/" in tail:  # Like **/{a/b,c}, each path is matched against the whole pattern
+            regex = _compile(self._prefix + glob_to_regex(pattern) + "$")
+            files = (path for path in self if regex.match(path))
+        else:
+            dirs = self._match_dirs(glob_to_regex(f"{head}/") if head else "")
+            files = self._files(dirs, self._match_names(glob_to_regex(tail)))
+        return list(itertools.islice(files, limit))
+
+    def _lowered(self, names: bool) -> List[Tuple[str, str]]:
+        """
+        The names, or the directories relative to their root, in lowercase with the original.
+        """
+        if names:
+            if self._lowered_names is None:
+                self._lowered_names = [(name.lower(), name) for name in self._names]
+            return self._lowered_names
+        if self._lowered_dirs is None:
+            lowered = []
+            for directory in self._dirs:
+                root = self._root_of(directory) or directory
+                lowered.append((directory[len(root) + 1 :].lower(), directory))
+            self._lowered_dirs = lowered
+        return self._lowered_dirs
+
+    def fuzzy(self, query: str, limit: int = 50) -> List[str]:
+        """
+        The files whose name contains the characters of query in order, the part of query
+        before its last / matches their directory the same way.
+        The files whose name contains query come first and then the shortest.
+        """
+        head, _, tail = "".join(query.split()).rpartition("/")
+        if not tail:
+            return []
+
+        tail = tail.lower()
+        names = [name for lower, name in self._lowered(names=True) if _subsequence(tail, lower)]
+        if head:
+            head = head.lower().replace("/", os.sep)
+            dirs = {d for lower, d in self._lowered(names=False) if _subsequence(head, lower)}
+        else:
+            dirs = None
+        names.sort(key=lambda name: (tail not in name.lower(), len(name)))
+        shortest = min(map(len, self._dirs), default=0)
+
+        # The names are tried from the best to the worst so the search stops at the first one
+        # that can't have a file better than the worst of the ones found, the heap holds them
+        # with that worst file at its top.
+        heap = []
+        for name in names:
+            score = tail not in name.lower()
+            if len(heap) == limit and (-score, -(shortest + len(name) + 1)) <= heap[0][:2]:
+                break
+            candidates = self._names[name]
+            if dirs is not None:
+                candidates = [directory for directory in candidates if directory in dirs]
+            for directory in heapq.nsmallest(limit, candidates, key=len):
+                item = (-score, -(len(directory) + len(name) + 1), directory + os.sep + name)
+                if len(heap) < limit:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+                else:
+                    break
+        return [path for _, _, path in sorted(heap, key=lambda item: (-item[0], -item[1], item[2]))]
@@ -0,0 +1,110 @@
+"""
+The JavaScript functions that python calls by id instead of sending code to eval.
+
+The table is written into extension.js by the compiler, the id of a procedure is its
+position in PROCEDURES so it must only ever be looked up through PROCEDURE_IDS.
+"""
+
+__all__ = ("PROCEDURES", "PROCEDURE_IDS", "create_procedures_js")
+
+
+PROCEDURES = {
+    # env
+    "getEnv": "(name) => vscode.env[name]",
+    "getEnvSnapshot": "() => envSnapshot()",
+    "readClipboard": "() => vscode.env.clipboard.readText()",
+    "writeClipboard": "(text) => vscode.env.clipboard.writeText(text)",
+    "openExternal": "(uri) => vscode.env.openExternal(vscode.Uri.parse(uri))",
+    # handles
+    "getAttr": "async (handle, name) => toRemote(await handles.get(handle)[name])",
+    "getAttrs": """(handle, names) => {
+    let obj = handles.get(handle);
+    return Promise.all(names.map(async (name) => toRemote(await obj[name])));
+  }""",
+    "release": "(handle) => releaseHandle(handle)",
+    # window
+    "getActiveTerminal": "() => terminalInfo(vscode.window.activeTerminal)",
+    "getTerminals": "() => vscode.window.terminals.map(terminalInfo)",
+    "getActiveTextEditor": "() => editorInfo(vscode.window.activeTextEditor)",
+    "getVisibleTextEditors": "() => vscode.window.visibleTextEditors.map(editorInfo)",
+    "terminalDispose": "(handle) => handles.get(handle).dispose()",
+    "terminalHide": "(handle) => handles.get(handle).hide()",
+    "terminalSendText": "(handle, text, addNewLine) => handles.get(handle).sendText(text, addNewLine)",
+    "terminalShow": "(handle, preserveFocus) => handles.get(handle).show(preserveFocus)",
+    "getDocumentText": """(handle, range) =>
+    handles.get(handle).getText(range ? new vscode.Range(...range) : undefined)""",
+    "editorEdit": """(handle, edits, undoStopBefore, undoStopAfter) =>
+    handles.get(handle).edit(
+      (builder) => {
+        for (let i = 0; i < edits.length; i += 5) {
+          builder.replace(new vscode.Range(edits[i], edits[i + 1], edits[i + 2], edits[i + 3]), edits[i + 4]);
+        }
+      },
+      { undoStopBefore, undoStopAfter }
+    )""",
+    "getDocumentSnapshot": """(handle) => {
+    let document = handles.get(handle);
+    trackedDocuments.add(document.uri.toString());
+    return [document.version, document.languageId, document.getText()];
+  }""",
+    "getDocumentLines": """(handle, start, end) => {
+    let document = handles.get(handle);
+    let lines = [];
+    for (let i = start; i < Math.min(end, document.lineCount); i++) {
+      lines.push(document.lineAt(i).text);
+    }
+    return [document.version, document.lineCount, lines];
+  }""",
+    "showMessage": "(type, content, items) => vscode.window[`show${type}Message`](content, ...items)",
+    "showQuickPick": "(items, options) => vscode.window.showQuickPick(items, options || undefined)",
+    "showInputBox": "(options) => vscode.window.showInputBox(options)",
+    "progressStart": """(title, location, cancellable) =>
+    new Promise((resolve) =>
+      vscode.window.withProgress({ location, title, cancellable }, (progress, token) => {
+        resolve();
+        return new Promise((done) => {
+          progressRecords[title] = { progress, token, done };
+        });
+      })
+    )""",
+    "progressReport": "(title, increment, message) => progressRecords[title].progress.report({ increment, message })",
+    "progressDone": """(title) => {
+    progressRecords[title].done();
+    delete progressRecords[title];
+  }""",
+    # webviews
+    "webviewCreate": """(id, title, column) => {
+    let p = vscode.window.createWebviewPanel(id, title, column, { enableScripts: true });
+    let handle = toHandle(p);
+
+    p.webview.onDidReceiveMessage((message) => send({ type: 4, id, name: "message", data: message }));
+    p.onDidDispose(() => {
+      releaseHandle(handle);
+      send({ type: 4, id, name: "dispose" });
+    });
+    p.onDidChangeViewState((e) => send({ type: 4, id, name: "change_view_state", data: { column: e.webviewPanel.viewColumn, active: e.webviewPanel.active, visible: e.webviewPanel.visible } }));
+    return handle;
+  }""",
+    "webviewSetHtml": "(handle, html) => { handles.get(handle).webview.html = html; }",
+    "webviewSetTitle": "(handle, title) => { handles.get(handle).title = title; }",
+    "webviewPostMessage": "(handle, message) => handles.get(handle).webview.postMessage(message)",
+    "webviewReveal": "(handle, column, preserveFocus) => handles.get(handle).reveal(column, preserveFocus)",
+    "webviewDispose": "(handle) => handles.get(handle).dispose()",
+    # workspace
+    "getConfiguration": "(section) => vscode.workspace.getConfiguration(section)",
+    "getWorkspaceFolders": "() => (vscode.workspace.workspaceFolders || []).map(folderInfo)",
+    "openTextDocument": "async (arg) => documentInfo(await vscode.workspace.openTextDocument(arg))",
+    "watchFiles": "() => watchFiles()",
+    "watchDirtyDocuments": "() => watchDirtyDocuments()",
+    "readFiles": "(uris) => readFiles(uris)",
+    "writeFiles": "(uris, contents) => writeFiles(uris, contents)",
+}
+
+PROCEDURE_IDS = {name: i for i, name in enumerate(PROCEDURES)}
+
+
+def create_procedures_js() -> str:
+    table = ",\n".join(
+        f"  // {i}: {name}\n  {source}" for i, (name, source) in enumerate(PROCEDURES.items())
+    )
+    return f"const procedures = [\n{table}\n];"
@@ -0,0 +1,311 @@
+"""
+An immutable rope, the text buffer behind the synced copies of documents.
+
+The text is split into chunks held by the leaves of a balanced (AVL) binary tree.
+Editing returns a new rope that shares every node it didn't touch with the old one,
+so an edit is O(log n) and keeping an old version around costs nothing.
+"""
+
+import re
+from typing import Iterator, Optional, Tuple, Union
+
+__all__ = ("Rope",)
+
+# Leaves are split in chunks of this many characters when building a rope, small leaves are
+# merged up to this size when joining
+LEAF_SIZE = 1024
+
+ASTRAL = re.compile("[\U00010000-\U0010ffff]")  # Characters that are 2 UTF-16 code units
+
+
+class _Node:
+    __slots__ = ("left", "right", "text", "length", "newlines", "wide", "height")
+
+    def __init__(self, left, right, text=None) -> None:
+        self.left = left
+        self.right = right
+        self.text = text
+        if text is not None:
+            self.length = len(text)
+            self.newlines = text.count("\n")
+            self.wide = 0 if text.isascii() else len(ASTRAL.findall(text))
+            self.height = 1
+        else:
+            self.length = left.length + right.length
+            self.newlines = left.newlines + right.newlines
+            self.wide = left.wide + right.wide
+            self.height = max(left.height, right.height) + 1
+
+
+def _height(node: Optional[_Node]) -> int:
+    return node.height if node is not None else 0
+
+
+def _leaf(text: str) -> Optional[_Node]:
+    return _Node(None, None, text) if text else None
+
+
+def _build(text: str, start: int, end: int) -> Optional[_Node]:
+    if end - start <= LEAF_SIZE:
+        return _leaf(text[start:end])
+    chunks = (end - start + LEAF_SIZE - 1) // LEAF_SIZE
+    middle = start + chunks // 2 * LEAF_SIZE
+    return _Node(_build(text, start, middle), _build(text, middle, end))
+
+
+def _balance(left: _Node, right: _Node) -> _Node:
+    # Joins two trees whose heights differ by at most 2 with a single or double rotation
+    hl = left.height
+    hr = right.height
+    if hl > hr + 1:
+        if _height(left.left) >= _height(left.right):
+            return _Node(left.left, _Node(left.right, right))
+        inner = left.right
+        return _Node(_Node(left.left, inner.left), _Node(inner.right, right))
+    if hr > hl + 1:
+        if _height(right.right) >= _height(right.left):
+            return _Node(_Node(left, right.left), right.right)
+        inner = right.left
+        return _Node(_Node(left, inner.left), _Node(inner.right, right.right))
+    return _Node(left, right)
+
+
+def _join(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.text is not None and right.text is not None and left.length + right.length <= LEAF_SIZE:
+        return _Node(None, None, left.text + right.text)
+
+    hl = left.height
+    hr = right.height
+    if hl > hr + 1:
+        return _balance(left.left, _join(left.right, right))
+    if hr > hl + 1:
+        return _balance(_join(left, right.left), right.right)
+    return _Node(left, right)
+
+
+def _split(node: Optional[_Node], index: int) -> Tuple[Optional[_Node], Optional[_Node]]:
+    if node is None:
+        return None, None
+    if index <= 0:
+        return None, node
+    if index >= node.length:
+        return node, None
+    if node.text is not None:
+        return _leaf(node.text[:index]), _leaf(node.text[index:])
+
+    left_length = node.left.length
+    if index <= left_length:
+        left, right = _split(node.left, index)
+        return left, _join(right, node.right)
+    left, right = _split(node.right, index - left_length)
+    return _join(node.left, left), right
+
+
+class Rope:
+    """
+    An immutable string that can be edited in O(log n).
+
+    Slicing a rope with [start:end] returns a rope that shares its nodes, str() and
+    slice() return the text itself.
+    Offsets are indexes of python strings, to_utf16 and from_utf16 convert them to the
+    UTF-16 offsets vscode uses.
+    The nodes count the line breaks under them so lines are found in O(log n) too.
+    """
+
+    __slots__ = ("_root",)
+
+    def __init__(self, text: str = "") -> None:
+        self._root = _build(text, 0, len(text))
+
+    @classmethod
+    def _from_root(cls, root: Optional[_Node]) -> "Rope":
+        rope = cls.__new__(cls)
+        rope._root = root
+        return rope
+
+    def __repr__(self):
+        return f"<vscode.Rope length={len(self)}>"
+
+    def __len__(self) -> int:
+        return self._root.length if self._root is not None else 0
+
+    def __str__(self) -> str:
+        return "".join(self.chunks())
+
+    def __eq__(self, other):
+        if isinstance(other, Rope):
+            return len(self) == len(other) and str(self) == str(other)
+        if isinstance(other, str):
+            return len(self) == len(other) and str(self) == other
+        return NotImplemented
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[str, "Rope"]:
+        if isinstance(key, slice):
+            start, end, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("Ropes can't be sliced with a step")
+            left, _ = _split(self._root, end)
+            _, middle = _split(left, start)
+            return Rope._from_root(middle)
+
+        length = len(self)
+        if key < 0:
+            key += length
+        if not 0 <= key < length:
+            raise IndexError("Rope index out of range")
+        node = self._root
+        while node.text is None:
+            if key < node.left.length:
+                node = node.left
+            else:
+                key -= node.left.length
+                node = node.right
+        return node.text[key]
+
+    @property
+    def height(self) -> int:
+        return _height(self._root)
+
+    @property
+    def line_count(self) -> int:
+        return self._root.newlines + 1 if self._root is not None else 1
+
+    def line_start(self, line: int) -> int:
+        """
+        The offset at which a line starts.
+        """
+        if line <= 0:
+            return 0
+        if line >= self.line_count:
+            raise IndexError("Rope line out of range")
+
+        # Finds the line break that ends the previous line
+        node = self._root
+        offset = 0
+        while node.text is None:
+            if line <= node.left.newlines:
+                node = node.left
+            else:
+                line -= node.left.newlines
+                offset += node.left.length
+                node = node.right
+        index = -1
+        for _ in range(line):
+            index = node.text.index("\n", index + 1)
+        return offset + index + 1
+
+    def line_of(self, index: int) -> int:
+        """
+        The line an offset is on.
+        """
+        node = self._root
+        line = 0
+        while node is not None and node.text is None:
+            if index < node.left.length:
+                node = node.left
+            else:
+                index -= node.left.length
+                line += node.left.newlines
+                node = node.right
+        if node is not None:
+            line += node.text.count("\n", 0, index)
+        return line
+
+    def chunks(self, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """
+        Yields the text between start and end in the pieces it is stored in.
+        """
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return
+
+        # In order walk that only goes down the subtrees that overlap the range
+        stack = [(self._root, 0)]
+        while stack:
+            node, offset = stack.pop()
+            while node.text is None:
+                middle = offset + node.left.length
+                if end <= middle:
+                    node = node.left
+                elif start >= middle:
+                    node = node.right
+                    offset = middle
+                else:
+                    stack.append((node.right, middle))
+                    node = node.left
+            yield node.text[max(start - offset, 0) : end - offset]
+
+    def slice(self, start: int, end: int) -> str:
+        """
+        The text between start and end, only the leaves in the range are read.
+        """
+        return "".join(self.chunks(start, end))
+
+    def insert(self, index: int, text: str) -> "Rope":
+        return self.replace(index, index, text)
+
+    def delete(self, start: int, end: int) -> "Rope":
+        return self.replace(start, end, "")
+
+    def replace(self, start: int, end: int, text: str) -> "Rope":
+        """
+        Returns a new rope where the text between start and end is replaced with text.
+        """
+        left, rest = _split(self._root, start)
+        _, right = _split(rest, end - start)
+        middle = _build(text, 0, len(text))
+        return Rope._from_root(_join(_join(left, middle), right))
+
+    def to_utf16(self, index: int) -> int:
+        """
+        Converts an index to an offset in UTF-16 code units.
+        """
+        node = self._root
+        if node is None or not node.wide:
+            return index
+
+        wide = 0
+        rest = index
+        while node is not None and node.text is None:
+            if rest < node.left.length:
+                node = node.left
+            else:
+                rest -= node.left.length
+                wide += node.left.wide
+                node = node.right
+        if node is not None and node.wide:
+            wide += len(ASTRAL.findall(node.text, 0, rest))
+        return index + wide
+
+    def from_utf16(self, offset: int) -> int:
+        """
+        Converts an offset in UTF-16 code units to an index.
+        An offset in the middle of a character is moved to the start of the next one.
+        """
+        node = self._root
+        if node is None or not node.wide:
+            return offset
+
+        index = 0
+        while node is not None and node.text is None:
+            left = node.left
+            if offset < left.length + left.wide:
+                node = left
+            else:
+                offset -= left.length + left.wide
+                index += left.length
+                node = node.right
+        if node is not None:
+            if not node.wide:
+                return index + min(offset, node.length)
+            units = 0
+            for i, c in enumerate(node.text):
+                if units >= offset:
+                    return index + i
+                units += 2 if ord(c) > 0xFFFF else 1
+            return index + node.length
+        return index
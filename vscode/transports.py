@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import os
+import socket
+import tempfile
+from typing import TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    import asyncio
+
+__all__ = ("TRANSPORTS", "ConnectionClosed", "FramedConnection")
+
+TRANSPORTS = ("websocket", "stdio", "unix")
+
+# The file descriptor of the pipe extension.js passes to the python process in stdio mode
+STDIO_FD = 3
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class FramedConnection:
+    """
+    A connection over a stream where every message is prefixed with its length
+    as a 4 byte big endian integer.
+
+    This has the same send/recv interface as a websocket so WSClient can use either.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, data: Union[str, bytes]) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        self.writer.write(len(data).to_bytes(4, "big"))
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def recv(self) -> bytes:
+        try:
+            header = await self.reader.readexactly(4)
+            return await self.reader.readexactly(int.from_bytes(header, "big"))
+        except (EOFError, ConnectionError):  # asyncio.IncompleteReadError is an EOFError
+            raise ConnectionClosed
+
+    async def close(self) -> None:
+        self.writer.close()
+
+
+async def open_stdio_connection(fd: int = STDIO_FD) -> FramedConnection:
+    """
+    Opens the pipe that extension.js created when spawning the python process.
+    stdout is left alone so printing still works.
+    """
+    import asyncio
+
+    sock = socket.socket(fileno=fd)
+    reader, writer = await asyncio.open_connection(sock=sock)
+    return FramedConnection(reader, writer)
+
+
+def get_unix_socket_path() -> str:
+    return os.path.join(tempfile.gettempdir(), f"vscode-py-{os.getpid()}.sock")
@@ -1,6 +1,5 @@
 from typing import Optional
 import uuid
-import json
 from vscode.enums import ViewColumn
 from vscode.utils import log
 
@@ -23,6 +22,7 @@ class WebviewPanel:
         self.column = column
         self._html = ""
         self.id = str(uuid.uuid4())
+        self.handle = None
         self.ws = None
         self.running = False
         self.active = True
@@ -35,16 +35,8 @@ class WebviewPanel:
     async def _setup(self, ws) -> None:
         self.ws = ws
         self.ws.webviews[self.id] = self
-        await self.ws.run_code(
-            f"""
-            let p = vscode.window.createWebviewPanel('{self.id}', '{self.title}', {self.column}, {{ enableScripts: true }}); 
-            webviews['{self.id}'] = p;
-
-            p.webview.onDidReceiveMessage((message) => ws.send(JSON.stringify({{ type: 4, id: '{self.id}', name: 'message', data: message }})));
-            p.onDidDispose(() => ws.send(JSON.stringify({{ type: 4, id: '{self.id}', name: 'dispose' }})));
-            p.onDidChangeViewState((e) => ws.send(JSON.stringify({{ type: 4, id: '{self.id}', name: 'change_view_state', data: {{column: e.webviewPanel.viewColumn, active: e.webviewPanel.active, visible: e.webviewPanel.visible}} }})));
-            """,
-            wait_for_response=False,
+        self.handle = await self.ws.call(
+            "webviewCreate", self.id, self.title, self.column
         )
         self.running = True
         await self.on_activate()
@@ -54,8 +46,8 @@ class WebviewPanel:
             raise ValueError(f"Webview is not running")
 
         self._html = html
-        await self.ws.run_code(
-            f"webviews['{self.id}'].webview.html = `{html}`", wait_for_response=False
+        await self.ws.call(
+            "webviewSetHtml", self.handle, html, wait_for_response=False
         )
 
     async def update_title(self, title: str) -> None:
@@ -63,18 +55,16 @@ class WebviewPanel:
             raise ValueError(f"Webview is not running")
 
         self.title = title
-        await self.ws.run_code(
-            f"webviews['{self.id}'].title = '{title}'", wait_for_response=False
+        await self.ws.call(
+            "webviewSetTitle", self.handle, title, wait_for_response=False
         )
 
     async def post_message(self, data: dict) -> None:
         if not self.running:
             raise ValueError(f"Webview is not running")
 
-        message = json.dumps(data)
-        await self.ws.run_code(
-            f"webviews['{self.id}'].webview.postMessage({message})",
-            wait_for_response=False,
+        await self.ws.call(
+            "webviewPostMessage", self.handle, data, wait_for_response=False
         )
 
     async def reveal(
@@ -85,8 +75,11 @@ class WebviewPanel:
         if not self.running:
             raise ValueError(f"Webview is not running")
 
-        await self.ws.run_code(
-            f"webviews['{self.id}'].webview.reveal({column}, {str(preserve_focus).lower()})",
+        await self.ws.call(
+            "webviewReveal",
+            self.handle,
+            column,
+            preserve_focus,
             wait_for_response=False,
         )
 
@@ -133,6 +126,4 @@ class WebviewPanel:
         if not self.running:
             raise ValueError(f"Webview is not running")
 
-        await self.ws.run_code(
-            f"webviews['{self.id}'].dispose()", wait_for_response=False
-        )
+        await self.ws.call("webviewDispose", self.handle, wait_for_response=False)
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import inspect
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Iterable, List, Optional, Union
+from typing import Any, AsyncIterator, Callable, Iterable, List, Optional, Union
 
+from vscode.documents import TextSnapshot, utf16_len, utf16_to_index
 from vscode.enums import ViewColumn, ProgressLocation
 from vscode.objects import QuickPickItem, QuickPickOptions, Position, Range, Selection
 
@@ -13,9 +15,11 @@ from vscode.webviews import WebviewPanel
 __all__ = (
     "Window",
     "TextEditor",
+    "TextEditorEdit",
     "TextDocument",
     "TextLine",
     "Terminal",
+    "RemoteObject",
     "QuickPick",
     "InputBox",
     "WindowState",
@@ -39,17 +43,26 @@ class Window:
         self._active_text_editor = None
 
     @property
-    async def active_terminal(self):
-        res = await self.ws.run_code("vscode.window.activeTerminal", thenable=False)
-        self._active_terminal = Terminal(res, self.ws, active=True)
+    async def active_terminal(self) -> Optional[Terminal]:
+        res = await self.ws.call("getActiveTerminal")
+        self._active_terminal = Terminal(res, self.ws, active=True) if res else None
         return self._active_terminal
 
     @property
-    async def active_text_editor(self):
-        res = await self.ws.run_code("vscode.window.activeTextEditor", thenable=False)
-        self._active_text_editor = TextEditor(res, self.ws, active=True)
+    async def active_text_editor(self) -> Optional[TextEditor]:
+        res = await self.ws.call("getActiveTextEditor")
+        self._active_text_editor = TextEditor(res, self.ws, active=True) if res else None
         return self._active_text_editor
 
+    @property
+    async def terminals(self) -> List[Terminal]:
+        return [Terminal(t, self.ws, active=False) for t in await self.ws.call("getTerminals")]
+
+    @property
+    async def visible_text_editors(self) -> List[TextEditor]:
+        editors = await self.ws.call("getVisibleTextEditors")
+        return [TextEditor(e, self.ws, active=False) for e in editors]
+
     async def show(self, item):
         if not isinstance(item, Showable):
             raise ValueError(f"item must be a Showable")
@@ -71,41 +84,119 @@ class Window:
         return Progress(self.ws, title, location, cancellable)
 
 
-class TextEditor:
+class RemoteObject:
+    """
+    An object that lives in extension.js and is referred to by a handle.
+
+    Attributes are fetched the first time they are awaited and cached afterwards,
+    use refresh() to fetch them again.
+    """
+
+    def __init__(self, handle: int, ws) -> None:
+        self.handle = handle
+        self.ws = ws
+        self._cache = {}
+
+    def __repr__(self):
+        return f"<vscode.{self.__class__.__name__} handle={self.handle}>"
+
+    async def _get(self, name: str):
+        if name not in self._cache:
+            self._cache[name] = await self.ws.call("getAttr", self.handle, name)
+        return self._cache[name]
+
+    async def fetch(self, *names: str) -> None:
+        """
+        Fetches many attributes in a single round trip.
+        """
+        names = [n for n in names if n not in self._cache]
+        if names:
+            values = await self.ws.call("getAttrs", self.handle, names)
+            self._cache.update(zip(names, values))
+
+    def refresh(self, *names: str) -> None:
+        """
+        Clears the cached attributes, every attribute is cleared if no names are given.
+        """
+        if names:
+            for name in names:
+                self._cache.pop(name, None)
+        else:
+            self._cache.clear()
+
+    async def release(self) -> None:
+        """
+        Releases the handle in extension.js, the object can't be used afterwards.
+        """
+        await self.ws.call("release", self.handle, wait_for_response=False)
+
+
+def remote_property(name: str, doc: Optional[str] = None) -> property:
+    async def getter(self):
+        return await self._get(name)
+
+    return property(getter, doc=doc)
+
+
+class TextEditor(RemoteObject):
     def __init__(self, data, ws, active) -> None:
+        super().__init__(data["handle"], ws)
         self._active = active
-        self.ws = ws
+        self.document = TextDocument(data=data["document"], ws=ws)
 
-        self.document = TextDocument(
-            data=data["document"],
-            ws=ws,
-            editor_code="let editor = vscode.window.activeTextEditor;",
-        )
-        self.options = data.get("creationOptions")
-        self.selection = data.get("selection")
-        self.selections = data.get("selections")
-
-        if self.selections:
-            self.selections = [Selection.from_dict(s) for s in self.selections]
-            self.selection = self.selections[0]
-
-        self.view_column = ViewColumn(data.get("viewColumn"))
-        self.visible_ranges = data.get("visibleRanges")
-        if self.visible_ranges:
-            self.visible_ranges = [
-                Range(start=Position.from_dict(r[0]), end=Position.from_dict(r[1]))
-                for r in self.visible_ranges
-            ]
+    options = remote_property("options")
+
+    @property
+    async def selections(self) -> List[Selection]:
+        selections = await self._get("selections")
+        return [Selection.from_dict(s) for s in selections]
+
+    @property
+    async def selection(self) -> Selection:
+        return Selection.from_dict(await self._get("selection"))
+
+    @property
+    async def view_column(self) -> Optional[ViewColumn]:
+        column = await self._get("viewColumn")
+        return ViewColumn(column) if column is not None else None
+
+    @property
+    async def visible_ranges(self) -> List[Range]:
+        return [
+            Range(start=Position.from_dict(r[0]), end=Position.from_dict(r[1]))
+            for r in await self._get("visibleRanges")
+        ]
 
     @property
-    def cursor(self) -> Position:
+    async def cursor(self) -> Position:
         """
         The cursor position of the 1st selection.
         """
-        return self.selection.active
+        return (await self.selection).active
 
-    async def edit(self, callback):
-        raise NotImplementedError
+    async def edit(
+        self,
+        callback: Callable[[TextEditorEdit], Any],
+        undo_stop_before: bool = True,
+        undo_stop_after: bool = True,
+    ) -> bool:
+        """
+        Edits the document of the editor.
+
+        The callback is passed a TextEditorEdit to queue the edits in, it can be a coroutine.
+        The edits are sent together and applied in a single editor.edit call,
+        returns whether they could be applied.
+        """
+        builder = TextEditorEdit()
+        result = callback(builder)
+        if inspect.isawaitable(result):
+            await result
+        if not builder.edits:
+            return True
+
+        return await self.ws.call(
+            "editorEdit", self.handle, builder.edits, undo_stop_before, undo_stop_after
+        )
 
     async def reveal_range(self, range: Range, reveal_type) -> Range:
         raise NotImplementedError
@@ -114,6 +205,34 @@ class TextEditor:
         raise NotImplementedError
 
 
+class TextEditorEdit:
+    """
+    Collects the edits passed to TextEditor.edit.
+
+    The edits are stored in a flat list of start line, start character, end line, end character and text,
+    they must not overlap.
+    """
+
+    def __init__(self) -> None:
+        self.edits = []
+
+    def __len__(self) -> int:
+        return len(self.edits) // 5
+
+    def replace(self, location: Union[Position, Range], value: str) -> None:
+        if isinstance(location, Position):
+            start = end = location
+        else:
+            start, end = location.start, location.end
+        self.edits += (start.line, start.character, end.line, end.character, value)
+
+    def insert(self, location: Position, value: str) -> None:
+        self.edits += (location.line, location.character, location.line, location.character, value)
+
+    def delete(self, location: Range) -> None:
+        self.replace(location, "")
+
+
 @dataclass
 class TextLine:
     first_non_whitespace_character_index: int
@@ -124,83 +243,220 @@ class TextLine:
     text: str
 
 
-class TextDocument:
-    def __init__(self, data, ws, editor_code) -> None:
-        for key, val in data.items():
-            setattr(self, key, val)
+class TextDocument(RemoteObject):
+    """
+    A text document, when the extension syncs documents its text is read from
+    the copy kept in python instead of being fetched.
+    """
 
-        self.ws = ws
-        self._editor_code = editor_code
+    def __init__(self, data, ws) -> None:
+        super().__init__(data["handle"], ws)
+        self.uri = data["uri"]
+
+    file_name = remote_property("fileName")
+    is_closed = remote_property("isClosed")
+    is_dirty = remote_property("isDirty")
+    is_untitled = remote_property("isUntitled")
+
+    @property
+    def mirror(self):
+        """
+        The synced copy of the document, None if documents aren't synced or it isn't open.
+        """
+        documents = getattr(self.ws, "documents", None)
+        return documents.get(self.uri) if documents is not None else None
+
+    def _cached(self) -> Optional[TextSnapshot]:
+        # The synced copy or the cached text of the current version
+        mirror = self.mirror
+        if mirror is not None:
+            return mirror
+        cache = getattr(self.ws, "text_cache", None)
+        return cache.get(self.uri) if cache is not None else None
+
+    async def _lines(self) -> TextSnapshot:
+        # Lines are looked up locally, in the synced copy or in the cached text
+        snapshot = self._cached()
+        if snapshot is None:
+            version, language_id, text = await self.ws.call("getDocumentSnapshot", self.handle)
+            snapshot = TextSnapshot(self.uri, version, language_id, text)
+            self.ws.text_cache.put(snapshot)
+        return snapshot
+
+    async def snapshot(self) -> TextSnapshot:
+        """
+        The text of the document at its current version, which doesn't change as the document is edited.
+        Without document sync the text is fetched and cached until the document changes.
+        """
+        mirror = self.mirror
+        if mirror is not None:
+            return mirror.snapshot()
+        return await self._lines()
+
+    @property
+    async def language_id(self) -> str:
+        mirror = self.mirror
+        return mirror.language_id if mirror is not None else await self._get("languageId")
+
+    @property
+    async def line_count(self) -> int:
+        mirror = self.mirror
+        return mirror.line_count if mirror is not None else await self._get("lineCount")
+
+    @property
+    async def version(self) -> int:
+        mirror = self.mirror
+        if mirror is not None:
+            return mirror.version
+        version = self.ws.text_cache.version(self.uri)
+        return version if version is not None else await self.ws.call("getAttr", self.handle, "version")
 
     async def get_text(self, range: Optional[Range] = None) -> str:
+        snapshot = self._cached()
+        if snapshot is not None:
+            if range is None:
+                return snapshot.get_text()
+            s = range.start
+            e = range.end
+            return snapshot.get_text([s.line, s.character, e.line, e.character])
+
         if range is None:
-            return await self.ws.run_code(
-                self._editor_code + "editor.document.getText();", thenable=False
-            )
-        
+            return (await self._lines()).get_text()
+
         s = range.start
         e = range.end
-        code = (
-            self._editor_code
-            + f"let range = new vscode.Range({s.line}, {s.character}, {e.line}, {e.character});"
-            + "editor.document.getText(range);"
+        return await self.ws.call(
+            "getDocumentText", self.handle, [s.line, s.character, e.line, e.character]
         )
-        return await self.ws.run_code(code, thenable=False)
+
+    async def get_lines(self, range: Range) -> List[str]:
+        """
+        Returns the lines in a range, the first and last lines only include the part that is in the range.
+        Only these lines are fetched when the text of the document isn't available locally.
+        """
+        s = range.start
+        e = range.end
+        snapshot = self._cached()
+        if snapshot is not None:
+            lines = snapshot.line_texts(s.line, e.line + 1)
+        else:
+            _, _, lines = await self.ws.call("getDocumentLines", self.handle, s.line, e.line + 1)
+
+        if lines:
+            if len(lines) == e.line - s.line + 1:
+                lines[-1] = lines[-1][: utf16_to_index(lines[-1], e.character)]
+            lines[0] = lines[0][utf16_to_index(lines[0], s.character) :]
+        return lines
+
+    async def iter_lines(
+        self, start: int = 0, end: Optional[int] = None, chunk: int = 2000
+    ) -> AsyncIterator[str]:
+        """
+        Yields the lines of the document from start up to end, or to the last line if end is None.
+
+        When the text isn't available locally the lines are fetched chunk lines at a time and the
+        next chunk is requested while the current one is being consumed, so huge documents can be
+        read without holding them in memory. If the document is edited meanwhile, later chunks come
+        from the new version.
+        """
+        snapshot = self._cached()
+        if snapshot is not None:
+            for i in range(start, snapshot.line_count if end is None else min(end, snapshot.line_count)):
+                yield snapshot.line_text(i)
+            return
+
+        def fetch(first: int) -> asyncio.Task:
+            last = first + chunk if end is None else min(first + chunk, end)
+            return asyncio.create_task(self.ws.call("getDocumentLines", self.handle, first, last))
+
+        pending = fetch(start)
+        try:
+            while pending is not None:
+                _, line_count, lines = await pending
+                following = start + len(lines)
+                limit = line_count if end is None else min(end, line_count)
+                pending = fetch(following) if lines and following < limit else None
+                for line in lines:
+                    yield line
+                start = following
+        finally:
+            if pending is not None:
+                pending.cancel()
 
     async def get_word_range_at_position(self, position: Position, regex) -> Range:
         raise NotImplementedError
 
     async def line_at(self, line_or_position: Union[int, Position]) -> TextLine:
-        raise NotImplementedError
+        lines = await self._lines()
+        line = line_or_position.line if isinstance(line_or_position, Position) else line_or_position
+        if not 0 <= line < lines.line_count:
+            raise ValueError(f"Illegal value for line: {line}")
+
+        text = lines.line_text(line)
+        indent = len(text) - len(text.lstrip())
+        length = utf16_len(text)
+        range = Range(Position(line, 0), Position(line, length))
+        if line + 1 < lines.line_count:
+            range_including_line_break = Range(Position(line, 0), Position(line + 1, 0))
+        else:
+            range_including_line_break = range
+
+        return TextLine(
+            first_non_whitespace_character_index=utf16_len(text[:indent]),
+            is_empty_or_whitespace=indent == len(text),
+            line_number=line,
+            range=range,
+            range_including_line_break=range_including_line_break,
+            text=text,
+        )
 
-    async def offset_at(self, position: Position) -> TextLine:
-        raise NotImplementedError
+    async def offset_at(self, position: Position) -> int:
+        lines = await self._lines()
+        return lines.to_utf16(lines.offset(position.line, position.character))
 
     async def position_at(self, offset: int) -> Position:
-        raise NotImplementedError
+        lines = await self._lines()
+        return Position(*lines.position(lines.from_utf16(offset)))
 
     async def save(self):
         raise NotImplementedError
 
     async def validate_position(self, position: Position) -> Position:
-        raise NotImplementedError
+        lines = await self._lines()
+        return Position(*lines.position(lines.offset(position.line, position.character)))
 
     async def validate_range(self, range: Range) -> Range:
-        raise NotImplementedError
+        start = await self.validate_position(range.start)
+        end = await self.validate_position(range.end)
+        return Range(start, end) if start <= end else Range(end, start)
 
 
-class Terminal:
+class Terminal(RemoteObject):
     def __init__(self, data, ws, active=True) -> None:
-        self.ws = ws
+        super().__init__(data["handle"], ws)
         self._active = active
-
         self.name = data["name"]
-        self.creation_options = data.get("creationOptions")
-        self.exit_status = data.get("exitStatus")
-        self.process_id = data.get("processID")
-        self.state = data.get("state")
-        self.dimensions = data.get("dimensions")
+
+    creation_options = remote_property("creationOptions")
+    exit_status = remote_property("exitStatus")
+    process_id = remote_property("processId")
+    state = remote_property("state")
+    dimensions = remote_property("dimensions")
 
     async def dispose(self) -> None:
-        await self.ws.run_code(
-            "vscode.window.activeTerminal.dispose()", wait_for_response=False
-        )
+        await self.ws.call("terminalDispose", self.handle, wait_for_response=False)
 
     async def hide(self) -> None:
-        await self.ws.run_code(
-            "vscode.window.activeTerminal.hide()", wait_for_response=False
-        )
+        await self.ws.call("terminalHide", self.handle, wait_for_response=False)
 
     async def send_text(self, text: str, add_new_line: bool = True):
-        await self.ws.run_code(
-            f'vscode.window.activeTerminal.sendText("{text}", {str(add_new_line).lower()})',
-            wait_for_response=False,
+        await self.ws.call(
+            "terminalSendText", self.handle, text, add_new_line, wait_for_response=False
         )
 
     async def show(self, preserve_focus: bool = False) -> None:
-        await self.ws.run_code(
-            f"vscode.window.activeTerminal.show({str(preserve_focus).lower()})",
-            wait_for_response=False,
+        await self.ws.call(
+            "terminalShow", self.handle, preserve_focus, wait_for_response=False
         )
 
 
@@ -229,12 +485,9 @@ class QuickPick(Showable, QuickInput):
 
     async def _show(self, ws) -> Optional[Union[QuickPickItem, List[QuickPickItem]]]:
         items = [i.to_dict() for i in self.items]
+        options = self.options.to_dict() if self.options else None
 
-        options = "," + json.dumps(self.options.to_dict()) if self.options else ""
-
-        chosen = await ws.run_code(
-            f"vscode.window.showQuickPick({json.dumps(items)}{options})",
-        )
+        chosen = await ws.call("showQuickPick", items, options)
         if chosen:
             if isinstance(chosen, dict):
                 return QuickPickItem(**chosen)
@@ -268,9 +521,7 @@ class InputBox(Showable, QuickInput):
             "placeHolder": self.place_holder,
             "value": self.value,
         }
-        return await ws.run_code(
-            f"vscode.window.showInputBox({json.dumps(options_dict)})"
-        )
+        return await ws.call("showInputBox", options_dict)
 
 
 @dataclass
@@ -288,13 +539,13 @@ class Message(Showable):
             self.type = "information"
 
     async def _show(self, ws):
-        base = f'vscode.window.show{self.type.capitalize()}Message("{self.content}"'
+        message_type = self.type.capitalize()
         if self.items:
-            return await ws.run_code(
-                base + "".join(f', "{i}"' for i in self.items) + ")",
-            )
+            return await ws.call("showMessage", message_type, self.content, list(self.items))
         else:
-            return await ws.run_code(base + ")", wait_for_response=False)
+            return await ws.call(
+                "showMessage", message_type, self.content, [], wait_for_response=False
+            )
 
 
 @dataclass
@@ -326,27 +577,8 @@ class Progress:
         self.location = location
 
     async def __aenter__(self):
-        await self.ws.run_code(
-            f"""
-            vscode.window.withProgress({{"location": {self.location.value}, "title": "{self.title}", "cancellable":{str(self.cancellable).lower()}}}, async (progress, token) => {{ 
-                progressRecords["{self.title}"] = {{ "progress": progress, "token": token, "completed": false }};
-
-                const checkProgressComplete = () => {{
-                    return new Promise(resolve => {{
-                        const interval = setInterval(() => {{
-                            if (progressRecords["{self.title}"].completed) {{
-                                console.log("Progress Complete");
-                                clearInterval(interval);
-                                resolve();
-                            }}
-                        }}, 100);
-                    }});
-                }};                                
-                
-                await checkProgressComplete();
-            }});
-            """,
-            thenable=False,
+        await self.ws.call(
+            "progressStart", self.title, self.location.value, self.cancellable
         )
         return self
 
@@ -354,17 +586,7 @@ class Progress:
         await self.dispose()
 
     async def report(self, increment: int, message: str = ""):
-        await self.ws.run_code(
-            f"""
-            progressRecords["{self.title}"].progress.report({{ increment: {increment}, message: "{message}" }});
-            """,
-            thenable=False,
-        )
+        await self.ws.call("progressReport", self.title, increment, message)
 
     async def dispose(self):
-        await self.ws.run_code(
-            f"""
-            progressRecords["{self.title}"].completed = true;
-            """,
-            thenable=False,
-        )
+        await self.ws.call("progressDone", self.title)
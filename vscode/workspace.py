@@ -1,37 +1,107 @@
-from typing import Optional, Union
+import os
+import re
+import mmap
+import base64
+import asyncio
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Set, Union
+from urllib.parse import unquote, urlparse
+
 from vscode.config import Config
+from vscode.files import FileIndex
+from vscode.window import TextDocument
+
+# Uris start with a scheme, it is at least 2 characters so that windows drives aren't one
+SCHEME = re.compile(r"[a-zA-Z][a-zA-Z0-9+.-]+:")
 
 
 class Workspace:
     def __init__(self, ws) -> None:
         self.ws = ws
+        self.fs = FileSystem(ws)
 
     async def get_extension_configs(self, extension_name: Optional[str] = None):
+        """
+        Returns the configuration of an extension, the configs of this extension are read from ws.config.
+        """
         if extension_name is None:
+            if self.ws.config.filled:
+                return dict(self.ws.config.values)
             extension_name = self.ws.extension.name
 
-        return await self.ws.run_code(
-            f'vscode.workspace.getConfiguration("{extension_name}")', thenable=False
-        )
+        return await self.ws.call("getConfiguration", extension_name)
 
     async def get_config_value(self, config: Union[str, Config]):
         if isinstance(config, Config):
             config = config.name
 
-        return (await self.get_extension_configs()).get(config)
+        if config in self.ws.config:
+            return self.ws.config[config]
+        value = (await self.get_extension_configs()).get(config)
+        declared = self.ws.config.configs.get(config)
+        return declared.convert(value) if declared is not None else value
 
-    async def get_workspace_folders(self):
-        folders = await self.ws.run_code(
-            "vscode.workspace.workspaceFolders", thenable=False
-        )
-        return (
-            [WorkspaceFolder(**folder) for folder in folders]
-            if folders is not None
-            else []
-        )
+    async def _get_folders(self) -> "WorkspaceFolders":
+        # extension.js sends the folders when python connects and whenever they change
+        if self.ws.workspace_folders is None:
+            folders = await self.ws.call("getWorkspaceFolders")
+            self.ws.workspace_folders = WorkspaceFolders.from_list(folders)
+        return self.ws.workspace_folders
+
+    async def get_workspace_folders(self) -> List["WorkspaceFolder"]:
+        return list((await self._get_folders()).folders)
+
+    async def get_workspace_folder(self, path: Union[str, "Uri"]) -> Optional["WorkspaceFolder"]:
+        """
+        Returns the workspace folder that contains a path or uri, None if it isn't in any of them.
+        """
+        return (await self._get_folders()).find(path)
+
+    async def as_relative_path(
+        self, path: Union[str, "Uri"], include_workspace_folder: Optional[bool] = None
+    ) -> str:
+        """
+        Returns a path relative to the workspace folder that contains it, with / as separator.
+        The name of the folder is prepended if include_workspace_folder is True,
+        by default it is when there are multiple workspace folders.
+        A path that isn't in a workspace folder is returned as it is.
+        """
+        return (await self._get_folders()).relative_path(path, include_workspace_folder)
 
-    async def open_text_document(self, file):
-        return await self.ws.run_code(f'vscode.workspace.openTextDocument("{file}")')
+    async def get_file_index(self) -> FileIndex:
+        """
+        Returns the index of the files in the workspace folders.
+        The folders are scanned the first time this is called, extension.js then watches them
+        and the index is updated as files are created and deleted.
+        """
+        index = self.ws.file_index
+        if index is None:
+            folders = await self.get_workspace_folders()
+            index = FileIndex([folder.uri.fs_path for folder in folders if folder.uri.scheme == "file"])
+            index.scanned = asyncio.ensure_future(self._scan(index))
+            self.ws.file_index = index
+        try:
+            await asyncio.shield(index.scanned)
+        except Exception:
+            if self.ws.file_index is index:
+                self.ws.file_index = None  # So the next call scans again
+            raise
+        return index
+
+    async def _scan(self, index: FileIndex) -> None:
+        # The watcher is started first so no change made during the scan is missed
+        await self.ws.call("watchFiles")
+        await self.ws.extension.run_in_executor("thread", index.scan)
+        index.flush()
+
+    async def find_files(self, pattern: str, max_results: Optional[int] = None) -> List[str]:
+        """
+        Returns the paths of the files that match a glob pattern like **/*.py, from the file index.
+        """
+        return (await self.get_file_index()).glob(pattern, max_results)
+
+    async def open_text_document(self, file) -> TextDocument:
+        return TextDocument(await self.ws.call("openTextDocument", file), self.ws)
 
     async def open_untitled_text_document(
         self, content: Optional[str] = None, language: Optional[str] = None
@@ -42,12 +112,13 @@ class Workspace:
         if language:
             obj["language"] = language
 
-        return await self.ws.run_code(f"vscode.workspace.openTextDocument({obj})")
+        return TextDocument(await self.ws.call("openTextDocument", obj), self.ws)
 
 
 class Uri:
-    def __init__(self, uri):
+    def __init__(self, uri: str, fs_path: Optional[str] = None):
         self._uri = uri
+        self._fs_path = fs_path
 
     def __repr__(self):
         return self._uri
@@ -56,14 +127,232 @@ class Uri:
         return self._uri
 
     @property
-    def fs_path(self):
-        return self._uri.replace("file://", "")
+    def scheme(self) -> str:
+        return urlparse(self._uri).scheme
+
+    @property
+    def fs_path(self) -> str:
+        if self._fs_path is None:
+            path = unquote(urlparse(self._uri).path)
+            # file:///c%3A/folder is c:\folder on windows
+            if os.name == "nt" and len(path) > 2 and path[0] == "/" and path[2] == ":":
+                path = path[1:].replace("/", "\\")
+            self._fs_path = path
+        return self._fs_path
 
 
 class WorkspaceFolder:
-    def __init__(self, index: int, name: str, uri: Union[Uri, dict]) -> None:
+    def __init__(self, index: int, name: str, uri: Union[Uri, str], fs_path: Optional[str] = None) -> None:
         self.index = index
         self.name = name
-        self.uri: Uri = (
-            uri if isinstance(uri, Uri) else Uri(uri["fsPath"])
-        )  # TODO: fix this
+        self.uri: Uri = uri if isinstance(uri, Uri) else Uri(uri, fs_path)
+
+    def __repr__(self):
+        return f"<vscode.WorkspaceFolder index={self.index} name={self.name} uri={self.uri}>"
+
+
+def _fs_path(path: Union[str, Uri]) -> str:
+    if isinstance(path, str) and SCHEME.match(path):
+        path = Uri(path)
+    if isinstance(path, Uri):
+        path = path.fs_path
+    return os.path.normpath(path)
+
+
+def _normalize(path: Union[str, Uri]) -> str:
+    return os.path.normcase(_fs_path(path))
+
+
+class WorkspaceFolders:
+    """
+    The workspace folders, indexed by path.
+
+    The paths of the folders are kept sorted with a separator at the end, the folder that
+    contains a path is found with a binary search, see find.
+    """
+
+    def __init__(self, folders: List[WorkspaceFolder]) -> None:
+        self.folders = sorted(folders, key=lambda folder: folder.index)
+        entries = sorted(
+            (
+                (os.path.join(_normalize(folder.uri), ""), folder)
+                for folder in self.folders
+                if folder.uri.scheme == "file"
+            ),
+            key=lambda entry: entry[0],
+        )
+        self._prefixes = [prefix for prefix, _ in entries]
+        self._folders = [folder for _, folder in entries]
+
+        # The position of the closest folder that contains each folder, -1 if there is none
+        self._parents = []
+        for i, prefix in enumerate(self._prefixes):
+            parent = i - 1
+            while parent >= 0 and not prefix.startswith(self._prefixes[parent]):
+                parent = self._parents[parent]
+            self._parents.append(parent)
+
+    @classmethod
+    def from_list(cls, folders: Optional[List[dict]]) -> "WorkspaceFolders":
+        return cls(
+            [
+                WorkspaceFolder(folder["index"], folder["name"], folder["uri"], folder.get("fsPath"))
+                for folder in folders or []
+            ]
+        )
+
+    def __len__(self) -> int:
+        return len(self.folders)
+
+    def find(self, path: Union[str, Uri]) -> Optional[WorkspaceFolder]:
+        """
+        The innermost folder that contains a path.
+        """
+        path = os.path.join(_normalize(path), "")
+
+        # The prefixes that sort between a folder and a path inside it are all inside
+        # that folder too, so the folder is the last prefix before the path or one of its parents.
+        i = bisect_right(self._prefixes, path) - 1
+        while i >= 0 and not path.startswith(self._prefixes[i]):
+            i = self._parents[i]
+        return self._folders[i] if i >= 0 else None
+
+    def relative_path(self, path: Union[str, Uri], include_workspace_folder: Optional[bool] = None) -> str:
+        folder = self.find(path)
+        if folder is None:
+            return str(path)
+
+        relative = os.path.relpath(_fs_path(path), _fs_path(folder.uri))
+        relative = "" if relative == "." else relative.replace(os.sep, "/")
+        if include_workspace_folder is None:
+            include_workspace_folder = len(self.folders) > 1
+        if include_workspace_folder:
+            relative = f"{folder.name}/{relative}" if relative else folder.name
+        return relative
+
+
+# Local files of at least this many bytes are memory mapped instead of read
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+
+def _local_path(uri: Union[str, Uri]) -> Optional[str]:
+    # The path of a file:// uri or of a path, None for the other schemes
+    if isinstance(uri, str) and not SCHEME.match(uri):
+        return uri
+    uri = uri if isinstance(uri, Uri) else Uri(str(uri))
+    return uri.fs_path if uri.scheme == "file" else None
+
+
+def _read_local(paths: List[str], mmap_threshold: Optional[int]) -> List[Union[bytes, mmap.mmap]]:
+    contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if mmap_threshold is not None and size >= max(mmap_threshold, 1):
+                contents.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            else:
+                contents.append(f.read())
+    return contents
+
+
+def _write_local(files: List[tuple]) -> None:
+    for path, data in files:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+class FileSystem:
+    """
+    Reads and writes files, the local ones without going through vscode.
+
+    Files with a path or a file:// uri are read from and written to the disk in the "io" thread
+    pool of the extension, see Extension.get_executor. A batch is split in one chunk per thread.
+    Files with other schemes and files open in a dirty editor go through vscode.workspace.fs,
+    the text of the editor is read for the latter.
+    """
+
+    def __init__(self, ws) -> None:
+        self.ws = ws
+
+    async def _dirty_documents(self) -> Set[str]:
+        # extension.js starts reporting the documents that become dirty or clean the first time
+        if self.ws.dirty_documents is None:
+            paths = await self.ws.call("watchDirtyDocuments")
+            self.ws.dirty_documents = {os.path.normcase(path) for path in paths}
+        return self.ws.dirty_documents
+
+    async def _split(self, uris: Sequence[Union[str, Uri]]) -> Dict[int, str]:
+        # The positions of the uris that are read and written locally, with their paths
+        paths = {i: path for i, path in enumerate(map(_local_path, uris)) if path is not None}
+        if paths:
+            dirty = await self._dirty_documents()
+            if dirty:
+                paths = {
+                    i: path
+                    for i, path in paths.items()
+                    if os.path.normcase(os.path.abspath(path)) not in dirty
+                }
+        return paths
+
+    def _chunks(self, items: list) -> List[list]:
+        workers = min(32, (os.cpu_count() or 1) + 4)  # The size of the "io" pool
+        size = -(-len(items) // workers)
+        return [items[i : i + size] for i in range(0, len(items), size)]
+
+    async def read_files(
+        self, uris: Sequence[Union[str, Uri]], mmap_threshold: Optional[int] = MMAP_THRESHOLD
+    ) -> List[Union[bytes, mmap.mmap]]:
+        """
+        Returns the contents of files in the order they were given.
+
+        Local files of at least mmap_threshold bytes are returned as read only mmap objects,
+        they can be sliced and searched with re like bytes but are only read as they are used.
+        Set mmap_threshold to None to always get bytes.
+        """
+        local = await self._split(uris)
+        remote = [i for i in range(len(uris)) if i not in local]
+        contents: List[Union[bytes, mmap.mmap]] = [b""] * len(uris)
+
+        positions = list(local)
+        chunks = self._chunks(positions) if positions else []
+        tasks = [
+            self.ws.extension.run_in_executor("io", _read_local, [local[i] for i in chunk], mmap_threshold)
+            for chunk in chunks
+        ]
+        if remote:
+            tasks.append(self.ws.call("readFiles", [str(uris[i]) for i in remote]))
+
+        results = await asyncio.gather(*tasks)
+        for chunk, data in zip(chunks, results):
+            for i, content in zip(chunk, data):
+                contents[i] = content
+        if remote:
+            for i, content in zip(remote, results[-1]):
+                contents[i] = content if isinstance(content, bytes) else base64.b64decode(content)
+        return contents
+
+    async def read_file(self, uri: Union[str, Uri], mmap_threshold: Optional[int] = MMAP_THRESHOLD):
+        return (await self.read_files([uri], mmap_threshold))[0]
+
+    async def write_files(self, files: Dict[Union[str, Uri], Union[bytes, str]]) -> None:
+        """
+        Writes files given as {uri: content}, str content is encoded in UTF-8.
+        The directories of local files are created if they don't exist, like vscode.workspace.fs.writeFile does.
+        """
+        uris = list(files)
+        contents = [data.encode("utf-8") if isinstance(data, str) else data for data in files.values()]
+        local = await self._split(uris)
+        remote = [i for i in range(len(uris)) if i not in local]
+
+        items = [(path, contents[i]) for i, path in local.items()]
+        chunks = self._chunks(items) if items else []
+        tasks = [self.ws.extension.run_in_executor("io", _write_local, chunk) for chunk in chunks]
+        if remote:
+            binary = self.ws.codec.binary
+            data = [contents[i] if binary else base64.b64encode(contents[i]).decode() for i in remote]
+            tasks.append(self.ws.call("writeFiles", [str(uris[i]) for i in remote], data))
+        await asyncio.gather(*tasks)
+
+    async def write_file(self, uri: Union[str, Uri], content: Union[bytes, str]) -> None:
+        await self.write_files({uri: content})
@@ -1,35 +1,111 @@
-import json
+import os
 import uuid
 import socket
 import asyncio
 import websockets
+from typing import Any, Dict, List, Optional, Union
+
+from vscode.codec import Codec, JSONCodec, get_codec
+from vscode.config import ConfigCache
+from vscode.documents import DocumentStore, TextCache
+from vscode.procedures import PROCEDURE_IDS
+from vscode.transports import (
+    TRANSPORTS,
+    ConnectionClosed,
+    FramedConnection,
+    get_unix_socket_path,
+    open_stdio_connection,
+)
+
+
+JSON_CODEC = JSONCodec()
 
 
 class WSClient:
     """
-    This class manages the websocket connection.
+    This class manages the connection to extension.js.
+
+    The connection is a websocket by default, see vscode.transports for the others.
     """
 
     BASE_URI = "ws://localhost:"
 
-    def __init__(self, extension, port: int = None) -> None:
+    def __init__(
+        self,
+        extension,
+        port: int = None,
+        timeout: Optional[float] = None,
+        codec: Union[str, Codec, None] = None,
+        binary: bool = False,
+        sync_documents: bool = False,
+        text_cache_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
         self.extension = extension
         self.port = port
         self.ws = None
+        self.timeout = timeout
+        self.codec = codec if isinstance(codec, Codec) else get_codec(codec)
+        self.binary = binary
+        self.negotiated = False
+        self.loop = None
 
-        self.responses = {}
+        self.pending = {}
         self.webviews = {}
+        self.documents = DocumentStore() if sync_documents else None
+        self.text_cache = TextCache(text_cache_bytes)
+        self.config = ConfigCache(getattr(extension, "config", ()))
+        self.env: Dict[str, Any] = {}  # The properties of vscode.env, sent by extension.js
+        self.workspace_folders = None  # A vscode.workspace.WorkspaceFolders, sent by extension.js
+        self.file_index = None  # A vscode.files.FileIndex, created by Workspace.get_file_index
+        self.dirty_documents = None  # The paths of the dirty documents, see vscode.workspace.FileSystem
 
     @property
     def uri(self) -> str:
         return self.BASE_URI + str(self.port)
 
+    def serve(self, transport: str = "websocket"):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"transport must be one of {TRANSPORTS}")
+
+        if transport == "stdio":
+            self.run_stdio()
+        elif transport == "unix":
+            self.run_unix_server()
+        else:
+            self.run_webserver()
+
+    def run_stdio(self):
+        async def stdio():
+            await self.serve_connection(await open_stdio_connection())
+
+        asyncio.run(stdio())
+
+    def run_unix_server(self):
+        path = get_unix_socket_path()
+
+        async def client_connected(reader, writer):
+            await self.serve_connection(FramedConnection(reader, writer))
+
+        async def unix_server():
+            async with await asyncio.start_unix_server(client_connected, path):
+                print(f"Listening on unix:{path}", flush=True)  # js will read this
+                await asyncio.Future()  # run forever
+
+        try:
+            asyncio.run(unix_server())
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
     def run_webserver(self):
         if self.port is None:
             self.port = self.get_free_port()
 
         async def webserver():
-            async with websockets.serve(self.handler, "localhost", self.port):
+            # Documents can be far bigger than the default limit of 1MB
+            async with websockets.serve(
+                self.handler, "localhost", self.port, max_size=None
+            ):
                 print(f"Listening on {self.uri}", flush=True)  # js will read this
                 await asyncio.Future()  # run forever
 
@@ -42,26 +118,244 @@ class WSClient:
         sock.close()
         return port
 
-    async def handler(self, websocket, path):
-        self.ws = websocket
-        while True:
+    async def handler(self, websocket, path=None):
+        await self.serve_connection(websocket)
+
+    async def serve_connection(self, connection):
+        """
+        Reads messages from a connection until it is closed.
+        """
+        self.ws = connection
+        self.negotiated = False
+        self.loop = asyncio.get_running_loop()
+        if self.documents is not None:
+            self.documents.clear()  # extension.js sends every open document again
+        self.text_cache.clear()  # and forgets which documents were cached
+        self.config.clear()
+        self.env.clear()
+        self.workspace_folders = None
+        self.file_index = None
+        self.dirty_documents = None
+        try:
+            while True:
+                try:
+                    message = await connection.recv()
+                except (websockets.ConnectionClosed, ConnectionClosed):
+                    break
+                data = self.decode(message)
+                if data.get("type") == 0:
+                    await self.handshake(data)
+                else:
+                    await self.extension.parse_ws_data(data)
+        finally:
+            self.cancel_pending()
+
+    async def handshake(self, data: dict) -> None:
+        """
+        Picks the format of the messages from the ones extension.js supports.
+        The handshake itself is always json.
+        """
+        codec = None
+        if (self.binary or self.codec.binary) and "msgpack" in data.get("formats", []):
             try:
-                message = await websocket.recv()
-            except websockets.ConnectionClosedOK:
-                break
-            data = json.loads(message)
-            await self.extension.parse_ws_data(data)
+                codec = get_codec("msgpack")
+            except ImportError:
+                print("msgpack isn't installed, falling back to json", flush=True)
+
+        fmt = "json" if codec is None else codec.name
+        await self.ws.send(JSON_CODEC.encode({"type": 0, "format": fmt}))
+        self.negotiated = True
+        if codec is not None:
+            self.codec = codec
+        elif self.codec.binary:
+            self.codec = get_codec()
 
-    async def run_code(self, code, wait_for_response=True, thenable=True):
+    def decode(self, message: Union[str, bytes]):
+        # The handshake and text frames are always json, even if a binary codec was requested
+        if (isinstance(message, str) or not self.negotiated) and self.codec.binary:
+            return JSON_CODEC.decode(message)
+        return self.codec.decode(message)
+
+    async def send(self, payload: dict) -> None:
+        await self.ws.send(self.codec.encode(payload))
+
+    async def run_code(self, code, wait_for_response=True, thenable=True, timeout=None):
         if wait_for_response:
             uid = str(uuid.uuid4())
             payload = {"type": 2 if thenable else 3, "code": code, "uuid": uid}
-            await self.ws.send(json.dumps(payload))
-            return await self.wait_for_response(uid)
+            future = self.create_future(uid)
+            await self.send(payload)
+            return await self.wait_for_response(uid, future, timeout)
+        else:
+            return await self.send({"type": 1, "code": code})
+
+    async def call(self, name: str, *args, wait_for_response=True, timeout=None):
+        """
+        Calls a procedure that was written into extension.js at build time.
+
+        Args:
+            name:
+                The name of the procedure, see vscode.procedures.
+            args:
+                JSON serializable arguments passed to the procedure.
+            wait_for_response:
+                Whether to wait for the result of the procedure.
+            timeout:
+                Overrides WSClient.timeout for this call.
+        """
+        payload = self.procedure(name, *args)
+        payload["type"] = 5
+        if wait_for_response:
+            uid = str(uuid.uuid4())
+            payload["uuid"] = uid
+            future = self.create_future(uid)
+            await self.send(payload)
+            return await self.wait_for_response(uid, future, timeout)
+        else:
+            return await self.send(payload)
+
+    @staticmethod
+    def procedure(name: str, *args) -> dict:
+        return {"fn": PROCEDURE_IDS[name], "args": list(args)}
+
+    async def run_many(self, codes: List[Union[str, dict]], sequential=True, timeout=None) -> list:
+        """
+        Runs many pieces of code in a single round trip and returns a list with their results.
+
+        Args:
+            codes:
+                The pieces of code to run, results of thenables are awaited.
+                Procedures created with WSClient.procedure can be mixed in.
+            sequential:
+                Whether the code should be run one after the other or concurrently.
+            timeout:
+                Overrides WSClient.timeout for this call.
+
+        Raises RuntimeError with the error of the first piece of code that failed,
+        a Batch reports the errors of each piece of code instead.
+        """
+        results, failed = await self._run_many(codes, sequential, timeout)
+        if failed:
+            raise RuntimeError(results[min(failed)]["error"])
+        return results
+
+    async def _run_many(self, codes: List[Union[str, dict]], sequential=True, timeout=None) -> tuple:
+        # Returns the results and the indexes of the codes that failed, whose result is {"error": message}
+        if not codes:
+            return [], []
+
+        uid = str(uuid.uuid4())
+        payload = {"type": 4, "codes": codes, "sequential": sequential, "uuid": uid}
+        future = self.create_future(uid)
+        await self.send(payload)
+        res = await self.wait_for_response(uid, future, timeout)
+        return res["results"], res["failed"]
+
+    def batch(self, sequential=True) -> "Batch":
+        return Batch(self, sequential)
+
+    def create_future(self, uid):
+        """
+        Registers a pending request, the future is resolved by resolve_response.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending[uid] = future
+        return future
+
+    async def wait_for_response(self, uid, future, timeout=None):
+        """
+        Waits for the response of a request.
+        If timeout (or WSClient.timeout) is not None, asyncio.TimeoutError is raised once it expires.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            # Drops the entry if the call timed out or was cancelled
+            self.pending.pop(uid, None)
+
+    def resolve_response(self, uid, res, error=None):
+        future = self.pending.pop(uid, None)
+        if future is None or future.done():
+            return
+
+        if error is not None:
+            future.set_exception(RuntimeError(error))
         else:
-            return await self.ws.send(json.dumps({"type": 1, "code": code}))
+            future.set_result(res)
+
+    def cancel_pending(self):
+        """
+        Cancels every request that is still waiting for a response.
+        """
+        for future in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+
+
+class Batch:
+    """
+    Collects code and sends all of it in one frame when the context manager exits.
+
+    .. code-block:: python
+
+        async with ctx.batch() as batch:
+            name = batch.run_code("vscode.env.appName")
+            language = batch.run_code("vscode.env.language")
+
+        print(name.result(), language.result())
+
+    The future of a piece of code that threw an error raises it as a RuntimeError.
+    """
+
+    def __init__(self, ws: WSClient, sequential=True) -> None:
+        self.ws = ws
+        self.sequential = sequential
+        self.codes = []
+        self.futures = []
 
-    async def wait_for_response(self, uid):
-        while not uid in self.responses:
-            await asyncio.sleep(0.1)
-        return self.responses.pop(uid)
+    def run_code(self, code: str) -> asyncio.Future:
+        """
+        Queues code, the returned future is resolved with its result once the batch is flushed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.codes.append(code)
+        self.futures.append(future)
+        return future
+
+    def call(self, name: str, *args) -> asyncio.Future:
+        """
+        Queues a procedure, the returned future is resolved with its result once the batch is flushed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.codes.append(self.ws.procedure(name, *args))
+        self.futures.append(future)
+        return future
+
+    async def flush(self) -> None:
+        codes, futures = self.codes, self.futures
+        self.codes, self.futures = [], []
+        try:
+            results, failed = await self.ws._run_many(codes, self.sequential)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        failed = set(failed)
+        for i, (future, res) in enumerate(zip(futures, results)):
+            if i in failed:
+                future.set_exception(RuntimeError(res["error"]))
+            else:
+                future.set_result(res)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.flush()
+        else:
+            for future in self.futures:
+                future.cancel()